@@ -8,7 +8,8 @@ class UserAdmin(BaseUserAdmin):
     """Admin interface for User model"""
     list_display = ['username', 'email', 'mobile', 'role', 'is_active', 'is_staff', 'created_at']
     list_filter = ['role', 'is_active', 'is_staff', 'created_at']
-    search_fields = ['username', 'email', 'mobile', 'first_name', 'last_name']
+    # Kept to the trigram-indexed columns (see accounts migration 0006)
+    search_fields = ['username', 'email', 'mobile']
     
     fieldsets = BaseUserAdmin.fieldsets + (
         ('Additional Information', {
@@ -0,0 +1,58 @@
+"""
+JWT authentication with a short-lived cache for the authenticated user.
+Avoids one User SELECT per request; entries are invalidated by accounts.signals on save/delete.
+Only enabled with a shared cache (REDIS_URL, see USER_CACHE_TIMEOUT): with the per-process
+fallback, invalidation would not reach the other workers, which would keep authorizing a
+deactivated user or an old role.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+# Columns kept in the cached entry (never the password hash); any other field is loaded from the
+# database on first access, like a deferred field
+USER_CACHE_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name', 'role',
+    'is_active', 'is_staff', 'is_superuser', 'white_label_id', 'created_by_id',
+)
+
+
+def user_cache_key(user_id):
+    return f'user:{user_id}'
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that reads request.user from Django's cache before hitting the DB."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        timeout = getattr(settings, 'USER_CACHE_TIMEOUT', 0)
+        if timeout <= 0:
+            return super().get_user(validated_token)
+
+        key = user_cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            # Cache miss: DB lookup plus simplejwt's active / revoked-token checks
+            user = super().get_user(validated_token)
+            cache.set(key, {field: getattr(user, field) for field in USER_CACHE_FIELDS}, timeout)
+            return user
+
+        # Built like a queryset row with only() applied, so save() writes back just these columns
+        # (from_db takes the values in model field order)
+        fields = [f.attname for f in self.user_model._meta.concrete_fields if f.attname in values]
+        user = self.user_model.from_db(
+            router.db_for_read(self.user_model), fields, [values[field] for field in fields]
+        )
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-14 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_white_label'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='mobile',
+            field=models.CharField(blank=True, db_index=True, max_length=15, null=True),
+        ),
+    ]
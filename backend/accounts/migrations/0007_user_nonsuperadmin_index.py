@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-14 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_user_role_and_upper_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('role', 'super_admin'), _negated=True), fields=['role'], name='user_nonsuperadmin_idx'),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Upper
+
+ADMIN_ROLES = frozenset({'super_admin', 'admin'})
 
 
 class User(AbstractUser):
@@ -14,7 +17,7 @@ class User(AbstractUser):
     ]
     
     email = models.EmailField(unique=True, blank=True, null=True)
-    mobile = models.CharField(max_length=15, blank=True, null=True)
+    mobile = models.CharField(max_length=15, blank=True, null=True, db_index=True)
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='user')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -44,6 +47,14 @@ class User(AbstractUser):
         db_table = 'users'
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+        indexes = [
+            models.Index(fields=['role']),
+            # Partial index for the Admin user listing, which excludes super_admin rows
+            models.Index(fields=['role'], condition=~models.Q(role='super_admin'), name='user_nonsuperadmin_idx'),
+            # Case-insensitive lookups on email/username (e.g. iexact)
+            models.Index(Upper('email'), name='user_email_upper_idx'),
+            models.Index(Upper('username'), name='user_username_upper_idx'),
+        ]
     
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
@@ -54,7 +65,7 @@ class User(AbstractUser):
     
     @property
     def is_admin(self):
-        return self.role == 'admin' or self.is_super_admin
+        return self.role in ADMIN_ROLES
     
     def has_role(self, *roles):
         """Check if user has any of the specified roles"""
@@ -1,4 +1,4 @@
-from rest_framework.permissions import BasePermission
+from rest_framework.permissions import BasePermission, SAFE_METHODS
 
 
 class IsSuperAdmin(BasePermission):
@@ -10,3 +10,64 @@ class IsSuperAdmin(BasePermission):
         if not request.user or not request.user.is_authenticated:
             return False
         return getattr(request.user, 'role', None) == 'super_admin'
+
+
+class IsAdminOrSuperAdmin(BasePermission):
+    """
+    Allows access only to users with role 'super_admin' or 'admin'.
+    `message` is a dict so the 403 body keeps the {'error', 'message'} shape used by the views.
+    """
+    message = {
+        'error': 'Permission denied',
+        'message': 'Only Admin or Super Admin can perform this action.'
+    }
+
+    def has_permission(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return False
+        return request.user.has_role('super_admin', 'admin')
+
+
+class CanRegisterRole(IsAdminOrSuperAdmin):
+    """
+    Registration: Super Admin can register Admin or User; Admin can register User only.
+    """
+    message = {
+        'error': 'Permission denied',
+        'message': 'Only Super Admin or Admin can register new users.'
+    }
+
+    def has_permission(self, request, view):
+        if not super().has_permission(request, view):
+            return False
+        requested_role = request.data.get('role', 'user')
+        if request.user.has_role('admin') and requested_role != 'user':
+            self.message = {
+                'error': 'Permission denied',
+                'message': 'Admin can only create User accounts. Contact Super Admin to create Admin accounts.'
+            }
+            return False
+        return True
+
+
+class CanChangeRole(BasePermission):
+    """
+    Only Super Admin may send a 'role' field when updating a user.
+    """
+    message = {
+        'error': 'Permission denied',
+        'message': 'Only Super Admin can change user roles'
+    }
+
+    def has_permission(self, request, view):
+        if request.method in SAFE_METHODS or 'role' not in request.data:
+            return True
+        return bool(request.user and request.user.is_authenticated and request.user.has_role('super_admin'))
+
+
+class CanChangeOwnRole(CanChangeRole):
+    """CanChangeRole for the current-user endpoint."""
+    message = {
+        'error': 'Permission denied',
+        'message': 'You cannot change your own role. Contact Super Admin.'
+    }
@@ -1,13 +1,20 @@
+import re
+
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import validate_email
 from .models import User
 from branding.models import WhiteLabel
 
+# Role -> label, resolved once instead of via get_role_display() per row
+ROLE_DISPLAY = dict(User.ROLE_CHOICES)
+
 
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for User model"""
     password = serializers.CharField(write_only=True, required=False, validators=[validate_password])
-    role_display = serializers.CharField(source='get_role_display', read_only=True)
+    role_display = serializers.SerializerMethodField(read_only=True)
     assigned_device_ids = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -19,6 +26,9 @@ class UserSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'is_superuser']
 
+    def get_role_display(self, obj):
+        return ROLE_DISPLAY.get(obj.role, obj.role)
+
     def get_assigned_device_ids(self, obj):
         return [d.id for d in obj.assigned_devices.all()]
     
@@ -40,13 +50,18 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
 
+# \w matches the same characters as str.isalnum() plus underscore
+_USERNAME_RE = re.compile(r'\w+')
+_MOBILE_NON_DIGITS_RE = re.compile(r'[^\d+]')
+
+
 def _validate_username(value):
     """Username: 3–150 chars, alphanumeric, underscore, no spaces."""
     if not value or len(value.strip()) < 3:
         raise serializers.ValidationError('Username must be at least 3 characters.')
     if len(value) > 150:
         raise serializers.ValidationError('Username must be 150 characters or fewer.')
-    if not all(c.isalnum() or c == '_' for c in value):
+    if not _USERNAME_RE.fullmatch(value):
         raise serializers.ValidationError('Username can only contain letters, numbers, and underscores.')
     return value.strip()
 
@@ -55,7 +70,7 @@ def _validate_mobile(value):
     """Mobile: digits, spaces, hyphens, plus; 8–15 chars."""
     if not value:
         return None
-    cleaned = ''.join(c for c in value if c.isdigit() or c == '+')
+    cleaned = _MOBILE_NON_DIGITS_RE.sub('', value)
     if len(cleaned) < 8 or len(cleaned) > 15:
         raise serializers.ValidationError('Enter a valid mobile number (8–15 digits).')
     return value.strip()
@@ -73,7 +88,9 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'password': {'write_only': True},
             'role': {'default': 'user'},
-            'email': {'required': False, 'allow_blank': True},
+            # Uniqueness is left to the DB constraints (RegisterView handles IntegrityError)
+            'username': {'validators': []},
+            'email': {'required': False, 'allow_blank': True, 'validators': []},
             'mobile': {'required': False, 'allow_blank': True},
             'first_name': {'allow_blank': True, 'max_length': 150},
             'last_name': {'allow_blank': True, 'max_length': 150},
@@ -85,8 +102,6 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     def validate_email(self, value):
         if not value or not value.strip():
             return None
-        from django.core.validators import validate_email
-        from django.core.exceptions import ValidationError as DjangoValidationError
         try:
             validate_email(value.strip())
         except DjangoValidationError:
@@ -152,7 +167,7 @@ class LoginSerializer(serializers.Serializer):
 
 class UserListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for user listing"""
-    role_display = serializers.CharField(source='get_role_display', read_only=True)
+    role_display = serializers.SerializerMethodField(read_only=True)
     assigned_device_ids = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -161,5 +176,25 @@ class UserListSerializer(serializers.ModelSerializer):
                   'first_name', 'last_name', 'is_active', 'created_at', 'assigned_device_ids']
         read_only_fields = fields
 
+    def get_role_display(self, obj):
+        return ROLE_DISPLAY.get(obj.role, obj.role)
+
     def get_assigned_device_ids(self, obj):
         return [d.id for d in obj.assigned_devices.all()]
+
+    def to_representation(self, instance):
+        # Read-only and flat: build the dict directly instead of DRF's per-field dispatch
+        created_at = instance.created_at
+        return {
+            'id': instance.id,
+            'username': instance.username,
+            'email': instance.email,
+            'mobile': instance.mobile,
+            'role': instance.role,
+            'role_display': self.get_role_display(instance),
+            'first_name': instance.first_name,
+            'last_name': instance.last_name,
+            'is_active': instance.is_active,
+            'created_at': self.fields['created_at'].to_representation(created_at) if created_at else None,
+            'assigned_device_ids': self.get_assigned_device_ids(instance),
+        }
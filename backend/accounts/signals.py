@@ -0,0 +1,16 @@
+"""
+Django signals for user-related events.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .authentication import user_cache_key
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached authenticated user so the next request reloads it from the DB."""
+    cache.delete(user_cache_key(instance.pk))
@@ -1,15 +1,19 @@
-from rest_framework import status, generics
+from rest_framework import status, generics, serializers
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
-from .permissions import IsSuperAdmin
+from .permissions import IsSuperAdmin, CanRegisterRole, CanChangeRole, CanChangeOwnRole
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import check_password
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Prefetch, Case, When, Value, IntegerField, Count, Max
+from core.conditional import conditional_response, make_etag
+from devices.models import Device
 from .models import User
 from .serializers import (
+    ROLE_DISPLAY,
     UserSerializer, 
     UserRegistrationSerializer, 
     LoginSerializer,
@@ -66,6 +70,61 @@ def api_root(request):
     })
 
 
+def _issue_tokens(user):
+    """Create a refresh token for user and derive its access token once; returns both signed."""
+    refresh = RefreshToken.for_user(user)
+    access = refresh.access_token
+    return {
+        'refresh': str(refresh),
+        'access': str(access),
+    }
+
+
+_datetime_field = serializers.DateTimeField()
+
+
+def _user_response(user, assigned_device_ids=None):
+    """Same shape as UserSerializer(user).data, built directly for the login/register responses."""
+    if assigned_device_ids is None:
+        assigned_device_ids = [d.id for d in user.assigned_devices.all()]
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'mobile': user.mobile,
+        'role': user.role,
+        'role_display': ROLE_DISPLAY.get(user.role, user.role),
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'is_active': user.is_active,
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        'created_at': _datetime_field.to_representation(user.created_at) if user.created_at else None,
+        'updated_at': _datetime_field.to_representation(user.updated_at) if user.updated_at else None,
+        'assigned_device_ids': assigned_device_ids,
+    }
+
+
+def _find_login_user(identifier):
+    """
+    Look up a user by email, mobile, or username in a single query (plus the
+    assigned device id prefetch). When several rows match, email wins over
+    mobile, and mobile over username.
+    """
+    queryset = User.objects.filter(Q(email=identifier) | Q(mobile=identifier) | Q(username=identifier))
+    return (
+        with_assigned_device_ids(queryset)
+        .annotate(match_rank=Case(
+            When(email=identifier, then=Value(0)),
+            When(mobile=identifier, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        ))
+        .order_by('match_rank', 'id')
+        .first()
+    )
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def login_view(request):
@@ -80,14 +139,7 @@ def login_view(request):
     email_or_mobile = serializer.validated_data['email_or_mobile']
     password = serializer.validated_data['password']
 
-    # Try to find user by email, mobile, or username
-    user = None
-    for field in ['email', 'mobile', 'username']:
-        try:
-            user = User.objects.get(**{field: email_or_mobile})
-            break
-        except User.DoesNotExist:
-            continue
+    user = _find_login_user(email_or_mobile)
 
     if user is None or not user.check_password(password):
         return Response(
@@ -101,15 +153,11 @@ def login_view(request):
             status=status.HTTP_403_FORBIDDEN,
         )
 
-    refresh = RefreshToken.for_user(user)
     return Response(
         {
             'message': 'Login successful',
-            'user': UserSerializer(user).data,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            },
+            'user': _user_response(user),
+            'tokens': _issue_tokens(user),
         },
         status=status.HTTP_200_OK,
     )
@@ -127,23 +175,10 @@ class LoginView(generics.GenericAPIView):
         email_or_mobile = serializer.validated_data['email_or_mobile']
         password = serializer.validated_data['password']
         
-        # Try to find user by email or mobile
-        try:
-            user = User.objects.get(email=email_or_mobile)
-        except User.DoesNotExist:
-            try:
-                user = User.objects.get(mobile=email_or_mobile)
-            except User.DoesNotExist:
-                try:
-                    user = User.objects.get(username=email_or_mobile)
-                except User.DoesNotExist:
-                    return Response(
-                        {'error': 'Invalid email/mobile or password'},
-                        status=status.HTTP_401_UNAUTHORIZED
-                    )
+        user = _find_login_user(email_or_mobile)
         
         # Authenticate user
-        if not user.check_password(password):
+        if user is None or not user.check_password(password):
             return Response(
                 {'error': 'Invalid email/mobile or password'},
                 status=status.HTTP_401_UNAUTHORIZED
@@ -155,19 +190,30 @@ class LoginView(generics.GenericAPIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Generate JWT tokens
-        refresh = RefreshToken.for_user(user)
-        
         return Response({
             'message': 'Login successful',
-            'user': UserSerializer(user).data,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            }
+            'user': _user_response(user),
+            'tokens': _issue_tokens(user)
         }, status=status.HTTP_200_OK)
 
 
+DUPLICATE_USER_ERRORS = {
+    'email': 'User with this email already exists',
+    'username': 'Username already taken',
+}
+
+
+def _unique_violation_field(exc):
+    """Return 'email' or 'username' when an IntegrityError comes from that unique constraint."""
+    # psycopg2 exposes the constraint name (e.g. users_username_key); SQLite only has the message
+    diag = getattr(exc.__cause__, 'diag', None)
+    target = getattr(diag, 'constraint_name', None) or str(exc)
+    for field in DUPLICATE_USER_ERRORS:
+        if f'users_{field}' in target or f'users.{field}' in target:
+            return field
+    return None
+
+
 class RegisterView(generics.CreateAPIView):
     """
     User registration endpoint - Super Admin only
@@ -175,28 +221,10 @@ class RegisterView(generics.CreateAPIView):
     """
     queryset = User.objects.all()
     serializer_class = UserRegistrationSerializer
-    permission_classes = [IsAuthenticated]
+    # Super Admin can register Admin or User; Admin can register User only
+    permission_classes = [IsAuthenticated, CanRegisterRole]
     
     def create(self, request, *args, **kwargs):
-        # Super Admin can register Admin or User; Admin can register User only
-        if not request.user.has_role('super_admin', 'admin'):
-            return Response(
-                {
-                    'error': 'Permission denied',
-                    'message': 'Only Super Admin or Admin can register new users.'
-                },
-                status=status.HTTP_403_FORBIDDEN
-            )
-        requested_role = request.data.get('role', 'user')
-        if request.user.has_role('admin') and requested_role != 'user':
-            return Response(
-                {
-                    'error': 'Permission denied',
-                    'message': 'Admin can only create User accounts. Contact Super Admin to create Admin accounts.'
-                },
-                status=status.HTTP_403_FORBIDDEN
-            )
-
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
@@ -212,21 +240,6 @@ class RegisterView(generics.CreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check if email already exists (only when email provided)
-        email = serializer.validated_data.get('email')
-        if email and User.objects.filter(email=email).exists():
-            return Response(
-                {'error': 'User with this email already exists'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Check if username already exists
-        if User.objects.filter(username=serializer.validated_data['username']).exists():
-            return Response(
-                {'error': 'Username already taken'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         # Enforce tenant / white-label inheritance rules
         requested_role = serializer.validated_data.get('role', 'user')
         white_label_id = serializer.validated_data.get('white_label_id') if isinstance(serializer.validated_data, dict) else None
@@ -244,7 +257,19 @@ class RegisterView(generics.CreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user = serializer.save()
+        # Email/username uniqueness is enforced by the DB constraints on INSERT,
+        # so no pre-check SELECTs are issued.
+        try:
+            with transaction.atomic():
+                user = serializer.save()
+        except IntegrityError as e:
+            field = _unique_violation_field(e)
+            if field is None:
+                raise
+            return Response(
+                {'error': DUPLICATE_USER_ERRORS[field]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         # Track who created this user so that Admins only see their own users
         if request.user.is_authenticated:
             user.created_by = request.user
@@ -255,22 +280,23 @@ class RegisterView(generics.CreateAPIView):
             else:
                 user.save(update_fields=['created_by'])
         
-        # Generate JWT tokens for the newly created user
-        refresh = RefreshToken.for_user(user)
-        
         return Response({
             'message': 'User registered successfully',
-            'user': UserSerializer(user).data,
-            'tokens': {
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            },
+            'user': _user_response(user, assigned_device_ids=[]),
+            'tokens': _issue_tokens(user),
             'note': 'New user can login with these credentials'
         }, status=status.HTTP_201_CREATED)
 
 
+def with_assigned_device_ids(queryset):
+    """Prefetch assigned device ids (PK only) so serializers avoid one query per user."""
+    return queryset.prefetch_related(
+        Prefetch('assigned_devices', queryset=Device.objects.only('id'))
+    )
+
+
 class UserListView(generics.ListAPIView):
-    """List all users - Admin and Super Admin only"""
+    """List all users - Admin and Super Admin only (paginated via DEFAULT_PAGINATION_CLASS, 50 per page)"""
     queryset = User.objects.all()
     serializer_class = UserListSerializer
     permission_classes = [IsAuthenticated]
@@ -279,16 +305,51 @@ class UserListView(generics.ListAPIView):
         user = self.request.user
         # Super Admin sees all users
         if user.has_role('super_admin'):
-            return User.objects.all()
+            queryset = User.objects.all()
         # Admin sees only:
         #  - themselves
         #  - users they created (typically role='user')
-        if user.has_role('admin'):
-            return User.objects.filter(
+        elif user.has_role('admin'):
+            queryset = User.objects.filter(
                 Q(id=user.id) | Q(created_by=user)
             ).exclude(role='super_admin')
         # Regular users can only see themselves
-        return User.objects.filter(id=user.id)
+        else:
+            queryset = User.objects.filter(id=user.id)
+        # Load only the columns UserListSerializer renders (skips password hash etc.)
+        return with_assigned_device_ids(queryset.only(
+            'id', 'username', 'email', 'mobile', 'role',
+            'first_name', 'last_name', 'is_active', 'created_at',
+        ).order_by('id'))
+
+    def _list_version(self, queryset):
+        """
+        ETag and last-modified time for the visible users, from two aggregates instead of
+        serializing every row. User count/updated_at cover edits and deletes; the device
+        assignment count/max id cover assigned_device_ids changes (which do not touch users).
+        """
+        users = queryset.aggregate(last_modified=Max('updated_at'), total=Count('id'))
+        assignments = Device.assigned_users.through.objects.filter(
+            user_id__in=queryset.values('id')
+        ).aggregate(total=Count('id'), last_id=Max('id'))
+        last_modified = users['last_modified']
+        # Scoped per requesting user so a shared browser cache never replays another user's list
+        etag = make_etag(
+            self.request.user.id,
+            users['total'],
+            last_modified.timestamp() if last_modified else 0,
+            assignments['total'],
+            assignments['last_id'] or 0,
+        )
+        return etag, last_modified
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self._list_version(self.get_queryset())
+        # Only the ETag decides 304s: deletes do not move Max(updated_at)
+        return conditional_response(
+            request, etag, lambda: super(UserListView, self).list(request, *args, **kwargs),
+            last_modified=last_modified,
+        )
 
 
 class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -303,12 +364,24 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
         if self.request.method == 'DELETE':
             # Only Super Admin can delete users
             return [IsSuperAdmin()]
-        return [IsAuthenticated()]
+        return [IsAuthenticated(), CanChangeRole()]
+
+    def get_queryset(self):
+        # Columns UserSerializer reads, plus created_by_id for the Admin scope check
+        return with_assigned_device_ids(User.objects.only(
+            'id', 'username', 'email', 'mobile', 'role', 'first_name', 'last_name',
+            'is_active', 'is_staff', 'is_superuser', 'created_at', 'updated_at', 'created_by_id',
+        ))
     
     def get_object(self):
         user = self.request.user
         pk = self.kwargs.get('pk')
-        target_user = get_object_or_404(User, pk=pk)
+
+        # Regular users can only access themselves; no need to load anyone else
+        if not user.has_role('super_admin', 'admin') and pk != user.id:
+            self.permission_denied(self.request)
+
+        target_user = get_object_or_404(self.get_queryset(), pk=pk)
 
         # Super Admin can access any user
         if user.has_role('super_admin'):
@@ -324,56 +397,13 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
                 self.permission_denied(self.request)
             return target_user
 
-        # Regular users can only access themselves
-        if user.id != target_user.id:
-            self.permission_denied(self.request)
         return target_user
-    
-    def update(self, request, *args, **kwargs):
-        """Override update with role-based permissions"""
-        user = request.user
-        target_user = self.get_object()
-        
-        # Role change permissions
-        if 'role' in request.data:
-            new_role = request.data['role']
-            
-            # Only Super Admin can change roles
-            if not user.has_role('super_admin'):
-                return Response(
-                    {
-                        'error': 'Permission denied',
-                        'message': 'Only Super Admin can change user roles'
-                    },
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            # Super Admin can change any role
-            # No restrictions on role changes for Super Admin
-        
-        return super().update(request, *args, **kwargs)
 
 
 class CurrentUserView(generics.RetrieveUpdateAPIView):
-    """Get/Update current authenticated user"""
+    """Get/Update current authenticated user. Only Super Admin can change their own role."""
     serializer_class = UserSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, CanChangeOwnRole]
     
     def get_object(self):
         return self.request.user
-    
-    def update(self, request, *args, **kwargs):
-        """Prevent users from changing their own role"""
-        user = request.user
-        
-        # Only Super Admin can change their own role
-        if 'role' in request.data and not user.has_role('super_admin'):
-            return Response(
-                {
-                    'error': 'Permission denied',
-                    'message': 'You cannot change your own role. Contact Super Admin.'
-                },
-                status=status.HTTP_403_FORBIDDEN
-            )
-        
-        return super().update(request, *args, **kwargs)
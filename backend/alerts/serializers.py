@@ -4,7 +4,7 @@ from devices.models import Threshold, Alarm
 
 class ThresholdSerializer(serializers.ModelSerializer):
     """Module 5: Limit configuration per device and parameter."""
-    device_id = serializers.IntegerField(source='device.id', read_only=True)
+    device_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Threshold
@@ -18,16 +18,6 @@ class ThresholdSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Parameter key must be 50 characters or fewer.')
         return str(value).strip()
 
-    def validate_min(self, value):
-        if value is not None and not isinstance(value, (int, float)):
-            raise serializers.ValidationError('Minimum must be a number.')
-        return value
-
-    def validate_max(self, value):
-        if value is not None and not isinstance(value, (int, float)):
-            raise serializers.ValidationError('Maximum must be a number.')
-        return value
-
     def validate(self, attrs):
         if attrs.get('min') is None and attrs.get('max') is None:
             raise serializers.ValidationError(
@@ -43,7 +33,7 @@ class ThresholdSerializer(serializers.ModelSerializer):
 
 class AlarmSerializer(serializers.ModelSerializer):
     """Module 5: Breach event - read and acknowledge."""
-    device_id = serializers.IntegerField(source='device.id', read_only=True)
+    device_id = serializers.IntegerField(read_only=True)
     device_name = serializers.CharField(source='device.name', read_only=True)
 
     class Meta:
@@ -4,7 +4,7 @@ from rest_framework.response import Response
 from django.utils import timezone
 
 from devices.models import Threshold, Alarm
-from devices.utils import get_visible_devices_queryset
+from devices.utils import filter_visible_devices
 from .serializers import ThresholdSerializer, AlarmSerializer
 
 
@@ -15,8 +15,8 @@ class ThresholdListView(generics.ListCreateAPIView):
     pagination_class = None
 
     def get_queryset(self):
-        visible = get_visible_devices_queryset(self.request.user)
-        qs = Threshold.objects.filter(device__in=visible).select_related('device')
+        # ThresholdSerializer only reads device_id, so no device join is needed
+        qs = filter_visible_devices(Threshold.objects.all(), self.request)
         device_id = self.request.query_params.get('device_id')
         if device_id:
             qs = qs.filter(device_id=device_id)
@@ -39,8 +39,7 @@ class ThresholdDetailView(generics.RetrieveUpdateDestroyAPIView):
     lookup_url_kwarg = 'id'
 
     def get_queryset(self):
-        visible = get_visible_devices_queryset(self.request.user)
-        return Threshold.objects.filter(device__in=visible).select_related('device')
+        return filter_visible_devices(Threshold.objects.all(), self.request)
 
     def update(self, request, *args, **kwargs):
         if not request.user.has_role('super_admin', 'admin'):
@@ -66,8 +65,14 @@ class AlarmListView(generics.ListAPIView):
     pagination_class = None
 
     def get_queryset(self):
-        visible = get_visible_devices_queryset(self.request.user)
-        qs = Alarm.objects.filter(device__in=visible).select_related('device')
+        # Only the columns AlarmSerializer renders; device_name is the one joined column
+        qs = filter_visible_devices(
+            Alarm.objects.select_related('device').only(
+                'id', 'device_id', 'device__name', 'parameter_key', 'parameter_label',
+                'value', 'threshold', 'type', 'timestamp', 'acknowledged',
+            ),
+            self.request,
+        )
         acknowledged = self.request.query_params.get('acknowledged')
         if acknowledged is not None:
             qs = qs.filter(acknowledged=acknowledged.lower() == 'true')
@@ -86,8 +91,7 @@ class AlarmDetailView(generics.RetrieveUpdateAPIView):
     http_method_names = ['get', 'patch', 'head', 'options']
 
     def get_queryset(self):
-        visible = get_visible_devices_queryset(self.request.user)
-        return Alarm.objects.filter(device__in=visible).select_related('device')
+        return filter_visible_devices(Alarm.objects.select_related('device'), self.request)
 
     def patch(self, request, *args, **kwargs):
         if not request.user.has_role('super_admin', 'admin'):
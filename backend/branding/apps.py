@@ -5,3 +5,7 @@ class BrandingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'branding'
     verbose_name = 'Branding'
+
+    def ready(self):
+        # Import signals to register them
+        import branding.signals  # noqa
@@ -1,6 +1,9 @@
 from django.db import models
 from django.conf import settings
 
+# Cache key for the singleton Branding (title, logo path); cleared whenever the row changes
+BRANDING_CACHE_KEY = 'branding:v1'
+
 
 class Branding(models.Model):
     """
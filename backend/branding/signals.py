@@ -0,0 +1,15 @@
+"""
+Django signals for branding changes.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Branding, BRANDING_CACHE_KEY
+
+
+@receiver(post_save, sender=Branding)
+@receiver(post_delete, sender=Branding)
+def invalidate_cached_branding(sender, instance, **kwargs):
+    """Drop the cached branding on every save/delete (BrandingView.patch or Django admin)."""
+    cache.delete(BRANDING_CACHE_KEY)
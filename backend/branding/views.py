@@ -1,16 +1,69 @@
+import hashlib
+
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import Branding, WhiteLabel
+from .models import Branding, WhiteLabel, BRANDING_CACHE_KEY
 from .serializers import BrandingSerializer, WhiteLabelSerializer
 from accounts.permissions import IsSuperAdmin
+from core.conditional import conditional_response, make_etag
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 
 # Singleton pk used for get_or_create
 BRANDING_PK = 1
 MAX_LOGO_SIZE_BYTES = 2 * 1024 * 1024  # 2MB
 ALLOWED_IMAGE_TYPES = ('image/png', 'image/jpeg', 'image/jpg', 'image/svg+xml', 'image/gif')
+_ALLOWED_IMAGE_TYPES_LOWER = frozenset(t.lower() for t in ALLOWED_IMAGE_TYPES)
+
+# Leading bytes of each allowed format; checked instead of trusting the client's content_type
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+def _sniff_image_type(logo_file):
+    """Content type from the file's first bytes, or None if it is not PNG/JPEG/GIF/SVG."""
+    header = logo_file.read(1024)
+    logo_file.seek(0)
+    for signature, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    # SVG is text: any markup start (<svg, <?xml, <!DOCTYPE svg, a comment) with an <svg tag in the first KB
+    text = header.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if text.startswith(b'<') and b'<svg' in text.lower():
+        return 'image/svg+xml'
+    return None
+
+
+def validate_logo_file(logo_file):
+    """Return a 400 Response if the upload is too large or not an allowed image, else None."""
+    if logo_file.size > MAX_LOGO_SIZE_BYTES:
+        return Response(
+            {'error': 'Logo file too large. Max size: 2MB.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    content_type = getattr(logo_file, 'content_type', '') or ''
+    if (content_type and content_type.lower() not in _ALLOWED_IMAGE_TYPES_LOWER) or _sniff_image_type(logo_file) is None:
+        return Response(
+            {'error': 'Invalid image type. Allowed: PNG, JPG, JPEG, SVG, GIF.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return None
+
+
+def _delete_replaced_logo(storage, old_name, new_name):
+    """Remove the previous logo file once the new one has been saved."""
+    if old_name and old_name != new_name:
+        try:
+            storage.delete(old_name)
+        except Exception:
+            pass
 
 
 def get_branding_instance():
@@ -22,6 +75,17 @@ def get_branding_instance():
     return branding
 
 
+def get_cached_branding():
+    """
+    (title, logo path) of the singleton Branding, cached so the public GET skips the DB.
+    The logo path is relative; callers build the absolute URL per request (host may differ).
+    """
+    def load():
+        branding = get_branding_instance()
+        return branding.title, branding.logo.url if branding.logo else ''
+    return cache.get_or_set(BRANDING_CACHE_KEY, load, timeout=settings.BRANDING_CACHE_TIMEOUT)
+
+
 class BrandingView(APIView):
     """
     GET: Public. Returns current branding (title, logo_url).
@@ -33,6 +97,15 @@ class BrandingView(APIView):
         return [IsAuthenticated(), IsSuperAdmin()]
 
     def get(self, request):
+        title, logo_url = self.get_branding(request)
+        # The payload is two short strings, so they are the version; a match skips the body
+        etag = make_etag(hashlib.md5(f'{title}\0{logo_url}'.encode()).hexdigest())
+        return conditional_response(
+            request, etag, lambda: Response({'title': title, 'logo_url': logo_url})
+        )
+
+    def get_branding(self, request):
+        """(title, absolute logo URL) for this request: the user's white-label, else the global branding."""
         # If authenticated and a white-label is assigned, return that branding
         if request.user and request.user.is_authenticated:
             white_label = getattr(request.user, 'white_label', None)
@@ -40,40 +113,31 @@ class BrandingView(APIView):
                 logo_url = ''
                 if white_label.logo:
                     logo_url = request.build_absolute_uri(white_label.logo.url)
-                return Response({'title': white_label.title, 'logo_url': logo_url})
+                return white_label.title, logo_url
 
-        branding = get_branding_instance()
-        serializer = BrandingSerializer(branding, context={'request': request})
-        return Response(serializer.data)
+        title, logo_path = get_cached_branding()
+        return title, request.build_absolute_uri(logo_path) if logo_path else ''
 
     def patch(self, request):
         branding = get_branding_instance()
-        data = {}
-        if 'title' in request.data:
-            data['title'] = request.data.get('title', branding.title)
+        update_fields = []
+        old_logo_name = branding.logo.name
         if 'logo' in request.FILES:
             logo_file = request.FILES['logo']
-            if logo_file.size > MAX_LOGO_SIZE_BYTES:
-                return Response(
-                    {'error': 'Logo file too large. Max size: 2MB.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            content_type = getattr(logo_file, 'content_type', '') or ''
-            if content_type and content_type.lower() not in [t.lower() for t in ALLOWED_IMAGE_TYPES]:
-                return Response(
-                    {'error': 'Invalid image type. Allowed: PNG, JPG, JPEG, SVG, GIF.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            # Remove old logo file if present
-            if branding.logo:
-                try:
-                    branding.logo.delete(save=False)
-                except Exception:
-                    pass
+            invalid = validate_logo_file(logo_file)
+            if invalid:
+                return invalid
             branding.logo = logo_file
-        if 'title' in request.data:
-            branding.title = request.data.get('title', branding.title).strip() or branding.title
-        branding.save()
+            update_fields.append('logo')
+        title = request.data.get('title')
+        if title is not None:
+            branding.title = title.strip() or branding.title
+            update_fields.append('title')
+        if update_fields:
+            branding.save(update_fields=update_fields)  # post_save clears the cached branding
+            # Old file goes only after the new one is stored and the row points at it
+            if 'logo' in update_fields:
+                _delete_replaced_logo(branding.logo.storage, old_logo_name, branding.logo.name)
         serializer = BrandingSerializer(branding, context={'request': request})
         return Response(serializer.data)
 
@@ -96,17 +160,9 @@ class WhiteLabelListCreateView(APIView):
 
         logo_file = request.FILES.get('logo')
         if logo_file:
-            if logo_file.size > MAX_LOGO_SIZE_BYTES:
-                return Response(
-                    {'error': 'Logo file too large. Max size: 2MB.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            content_type = getattr(logo_file, 'content_type', '') or ''
-            if content_type and content_type.lower() not in [t.lower() for t in ALLOWED_IMAGE_TYPES]:
-                return Response(
-                    {'error': 'Invalid image type. Allowed: PNG, JPG, JPEG, SVG, GIF.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            invalid = validate_logo_file(logo_file)
+            if invalid:
+                return invalid
 
         obj = WhiteLabel.objects.create(
             name=serializer.validated_data['name'].strip(),
@@ -138,25 +194,17 @@ class WhiteLabelDetailView(APIView):
 
         if 'logo' in request.FILES:
             logo_file = request.FILES['logo']
-            if logo_file.size > MAX_LOGO_SIZE_BYTES:
-                return Response(
-                    {'error': 'Logo file too large. Max size: 2MB.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            content_type = getattr(logo_file, 'content_type', '') or ''
-            if content_type and content_type.lower() not in [t.lower() for t in ALLOWED_IMAGE_TYPES]:
-                return Response(
-                    {'error': 'Invalid image type. Allowed: PNG, JPG, JPEG, SVG, GIF.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            if obj.logo:
-                try:
-                    obj.logo.delete(save=False)
-                except Exception:
-                    pass
+            invalid = validate_logo_file(logo_file)
+            if invalid:
+                return invalid
+            old_logo_name = obj.logo.name
             obj.logo = logo_file
+        else:
+            old_logo_name = None
 
         obj.save()
+        if old_logo_name is not None:
+            _delete_replaced_logo(obj.logo.storage, old_logo_name, obj.logo.name)
         serializer = WhiteLabelSerializer(obj, context={'request': request})
         return Response(serializer.data)
 
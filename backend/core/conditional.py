@@ -0,0 +1,24 @@
+"""Conditional GET (ETag / 304) helper shared by polled list endpoints."""
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Quoted ETag from the given version parts (ids, counts, timestamps)."""
+    return quote_etag('-'.join(str(part) for part in parts))
+
+
+def conditional_response(request, etag, build_response, last_modified=None):
+    """
+    Return 304 when If-None-Match matches etag, otherwise build_response().
+    Only the ETag decides 304s; last_modified (aware datetime) is sent as a header only.
+    The response may be stored by the browser but must be revalidated on every use.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = build_response()
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,16 @@
+"""JSON encoders for model fields."""
+import orjson
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class OrjsonJSONEncoder(DjangoJSONEncoder):
+    """
+    JSONField encoder: compact orjson output for plain dicts of numbers and strings (ingest
+    payloads), falling back to DjangoJSONEncoder for anything orjson rejects (Decimal, int keys).
+    """
+
+    def encode(self, o):
+        try:
+            return orjson.dumps(o).decode()
+        except orjson.JSONEncodeError:
+            return super().encode(o)
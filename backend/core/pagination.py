@@ -1,11 +1,12 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
-class DeviceListPagination(PageNumberPagination):
-    """Pagination for device list with optional page_size query param (capped at 500)."""
-    page_size = 50
+class PageSizeQueryParamMixin:
+    """
+    ?page_size=N for the paginators below: honoured when 1 <= N <= max_page_size, otherwise
+    (missing, invalid or too large) the class's default page_size is used.
+    """
     page_size_query_param = 'page_size'
-    max_page_size = 500
 
     def get_page_size(self, request):
         try:
@@ -19,19 +20,42 @@ class DeviceListPagination(PageNumberPagination):
         return self.page_size
 
 
-class DeviceDataListPagination(PageNumberPagination):
+class DeviceListPagination(PageSizeQueryParamMixin, PageNumberPagination):
+    """Pagination for device list with optional page_size query param (capped at 500)."""
+    page_size = 50
+    max_page_size = 500
+
+
+class DeviceCursorPagination(PageSizeQueryParamMixin, CursorPagination):
+    """
+    Opt-in cursor pagination for the device list (?paginate=cursor): keyset on created_at, so deep
+    pages cost the same as the first. Same page sizes as DeviceListPagination; no count.
+    """
+    page_size = 50
+    max_page_size = 500
+    ordering = '-created_at'
+
+
+class DeviceDataListPagination(PageSizeQueryParamMixin, PageNumberPagination):
     """Pagination for device-data list (Module 7). Export-friendly: max_page_size 10000."""
     page_size = 500
-    page_size_query_param = 'page_size'
     max_page_size = 10000
 
-    def get_page_size(self, request):
-        try:
-            value = request.query_params.get(self.page_size_query_param)
-            if value is not None:
-                size = int(value)
-                if 1 <= size <= self.max_page_size:
-                    return size
-        except (ValueError, TypeError):
-            pass
-        return self.page_size
+
+class DeviceDataCursorPagination(PageSizeQueryParamMixin, CursorPagination):
+    """
+    Cursor pagination for device-data list: keyset on timestamp, so deep pages cost the same as
+    the first (no OFFSET scan). Response has next/previous cursors but no count.
+    """
+    page_size = 500
+    max_page_size = 10000
+    ordering = '-timestamp'
+
+    def get_ordering(self, request, queryset, view):
+        # Follow the view's ordering (ascending for date-range queries, newest first otherwise)
+        ordering = tuple(queryset.query.order_by) or (self.ordering,)
+        # Readings can share a timestamp: break ties on id in the same direction so every row
+        # keeps one position across pages
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('-id',) if ordering[0].startswith('-') else ('id',)
+        return ordering
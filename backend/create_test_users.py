@@ -5,55 +5,29 @@ Or: python manage.py shell, then copy-paste this code
 """
 from accounts.models import User
 
-# Create Super Admin
-super_admin, created = User.objects.get_or_create(
-    username='superadmin',
-    defaults={
-        'email': 'superadmin@example.com',
-        'role': 'super_admin',
-        'is_staff': True,
-        'is_superuser': True,
-    }
-)
-if created:
-    super_admin.set_password('password')
-    super_admin.save()
-    print(f"✅ Created Super Admin: {super_admin.username}")
-else:
-    print(f"ℹ️  Super Admin already exists: {super_admin.username}")
-
-# Create Admin
-admin_user, created = User.objects.get_or_create(
-    username='admin',
-    defaults={
-        'email': 'admin@example.com',
-        'role': 'admin',
-        'is_staff': True,
-    }
-)
-if created:
-    admin_user.set_password('password')
-    admin_user.save()
-    print(f"✅ Created Admin: {admin_user.username}")
-else:
-    print(f"ℹ️  Admin already exists: {admin_user.username}")
+TEST_USERS = [
+    # (label, username, email, role, is_staff, is_superuser)
+    ('Super Admin', 'superadmin', 'superadmin@example.com', 'super_admin', True, True),
+    ('Admin', 'admin', 'admin@example.com', 'admin', True, False),
+    ('User', 'user', 'user@example.com', 'user', False, False),
+]
 
-# Create Regular User
-regular_user, created = User.objects.get_or_create(
-    username='user',
-    defaults={
-        'email': 'user@example.com',
-        'role': 'user',
-    }
+# One lookup for the existing accounts, one INSERT for the missing ones
+existing = set(
+    User.objects.filter(username__in=[u[1] for u in TEST_USERS]).values_list('username', flat=True)
 )
-if created:
-    regular_user.set_password('password')
-    regular_user.save()
-    print(f"✅ Created User: {regular_user.username}")
-else:
-    print(f"ℹ️  User already exists: {regular_user.username}")
+new_users = []
+for label, username, email, role, is_staff, is_superuser in TEST_USERS:
+    if username in existing:
+        print(f"ℹ️  {label} already exists: {username}")
+        continue
+    user = User(username=username, email=email, role=role, is_staff=is_staff, is_superuser=is_superuser)
+    user.set_password('password')  # hashed in memory, no query
+    new_users.append(user)
+    print(f"✅ Created {label}: {username}")
+User.objects.bulk_create(new_users, ignore_conflicts=True)
 
 print("\n📋 Test Users Created:")
 print("=" * 50)
-for user in User.objects.all():
+for user in User.objects.only('username', 'email', 'role'):
     print(f"Username: {user.username:15} | Email: {user.email:25} | Role: {user.role}")
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from devices.models import Device, DeviceData
+from devices.services import INGEST_DEVICE_FIELDS
 
 
 class DeviceDataSerializer(serializers.ModelSerializer):
@@ -18,6 +19,19 @@ class DeviceDataSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'timestamp']
 
+    def to_representation(self, instance):
+        # Every field is a plain column or device.<column>; build the dict directly instead of
+        # going through per-field get_attribute()/to_representation() for each row
+        device = instance.device
+        return {
+            'id': instance.id,
+            'device': instance.device_id,
+            'device_name': device.name,
+            'device_hardware_address': device.hardware_address,
+            'parameters': instance.parameters,
+            'timestamp': self.fields['timestamp'].to_representation(instance.timestamp) if instance.timestamp else None,
+        }
+
 
 class DeviceDataCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating device data (from hardware) - accepts device id + parameters"""
@@ -43,7 +57,7 @@ class DeviceDataIngestSerializer(serializers.Serializer):
     Accepts either "device" (id) or "hardware_address" (5-digit) + "parameters".
     """
     hardware_address = serializers.CharField(required=False, max_length=5, allow_blank=True)
-    device = serializers.PrimaryKeyRelatedField(queryset=Device.objects.all(), required=False)
+    device = serializers.PrimaryKeyRelatedField(queryset=Device.objects.only(*INGEST_DEVICE_FIELDS), required=False)
     parameters = serializers.JSONField()
 
     def validate(self, attrs):
@@ -63,7 +77,7 @@ class DeviceDataIngestSerializer(serializers.Serializer):
                 raise serializers.ValidationError(
                     {'hardware_address': 'Hardware address must be exactly 5 digits.'}
                 )
-            device = Device.objects.filter(hardware_address=hw, is_active=True).first()
+            device = Device.objects.filter(hardware_address=hw, is_active=True).only(*INGEST_DEVICE_FIELDS).first()
             if not device:
                 raise serializers.ValidationError(
                     {'hardware_address': 'No active device with this hardware address.'}
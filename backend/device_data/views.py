@@ -1,33 +1,46 @@
+import hashlib
+import json
 from datetime import datetime
-from functools import reduce
+from functools import lru_cache
+from itertools import islice
 from rest_framework import generics, status
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
-from django.db.models import Q, Max
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.http import StreamingHttpResponse
 from django.utils import timezone as django_tz
 
 from devices.models import Device, DeviceData
-from devices.services import check_thresholds_and_create_alarms
-from devices.utils import get_visible_devices_queryset
-from core.pagination import DeviceDataListPagination
+from devices.services import (
+    bump_device_data_version, check_thresholds_async, get_device_data_version, record_last_data_received,
+)
+from devices.utils import get_visible_devices_queryset, get_visible_device_ids, filter_visible_devices
+from core.conditional import conditional_response, make_etag
+from core.pagination import DeviceDataListPagination, DeviceDataCursorPagination
 from .serializers import DeviceDataSerializer, DeviceDataIngestSerializer
 
 
+@lru_cache(maxsize=1024)
+def _parse_date_cached(value, tz):
+    """Parse a stripped date/datetime string to an aware datetime (None if invalid); cached per (value, tz)."""
+    try:
+        # fromisoformat accepts 'Z' offsets and bare dates; date-only params ignore anything past YYYY-MM-DD
+        dt = datetime.fromisoformat(value if 'T' in value else value[:10])
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = django_tz.make_aware(dt, tz)
+    return dt
+
+
 def _parse_date_param(value):
     """Parse from_date/to_date query param to timezone-aware datetime. Date-only => start/end of day."""
     if not value or not value.strip():
         return None
-    value = value.strip()
-    try:
-        if 'T' in value:
-            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-        else:
-            dt = datetime.strptime(value[:10], '%Y-%m-%d')
-        if dt.tzinfo is None:
-            dt = django_tz.make_aware(dt, django_tz.get_current_timezone())
-        return dt
-    except (ValueError, TypeError):
-        return None
+    return _parse_date_cached(value.strip(), django_tz.get_current_timezone())
 
 
 class DeviceDataCreateView(generics.CreateAPIView):
@@ -44,12 +57,13 @@ class DeviceDataCreateView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
 
         device_data = serializer.save()
+        transaction.on_commit(bump_device_data_version)
 
         device = device_data.device
-        device.last_data_received = device_data.timestamp
-        device.save(update_fields=['last_data_received'])
+        record_last_data_received(device, device_data.timestamp)
 
-        check_thresholds_and_create_alarms(device, device_data.parameters or {})
+        if device_data.parameters:
+            check_thresholds_async(device, device_data.parameters)
 
         return Response(
             {
@@ -63,21 +77,42 @@ class DeviceDataCreateView(generics.CreateAPIView):
 class DeviceDataListView(generics.ListAPIView):
     """
     List device data (historical data). Module 7: supports from_date, to_date for time-range filtering.
+    Cursor-paginated; pass paginate=page for page-number pagination (with count).
+    export=ndjson streams the matching rows as JSON lines, unpaginated, up to
+    DEVICE_DATA_EXPORT_MAX_ROWS rows.
     """
     serializer_class = DeviceDataSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = DeviceDataListPagination
+
+    @property
+    def pagination_class(self):
+        if self.request.query_params.get('paginate') == 'page':
+            return DeviceDataListPagination
+        return DeviceDataCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('export') == 'ndjson':
+            queryset = self.filter_queryset(self.get_queryset())
+            return self.stream_ndjson(queryset[:settings.DEVICE_DATA_EXPORT_MAX_ROWS])
+        return super().list(request, *args, **kwargs)
+
+    def stream_ndjson(self, queryset):
+        """Serialize one row at a time from a chunked cursor, so memory stays flat for large exports."""
+        serializer = self.get_serializer()
+
+        def lines():
+            for row in queryset.iterator(chunk_size=1000):
+                yield json.dumps(serializer.to_representation(row), cls=JSONEncoder) + '\n'
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
 
     def get_queryset(self):
-        user = self.request.user
         device_id = self.request.query_params.get('device_id', None)
         from_date = self.request.query_params.get('from_date', None)
         to_date = self.request.query_params.get('to_date', None)
 
-        if user.has_role('super_admin', 'admin'):
-            queryset = DeviceData.objects.all()
-        else:
-            queryset = DeviceData.objects.filter(device__assigned_users=user)
+        # Flat device_id IN (...) filter; no M2M join, so no duplicate rows
+        queryset = filter_visible_devices(DeviceData.objects.all(), self.request)
 
         if device_id:
             queryset = queryset.filter(device_id=device_id)
@@ -91,9 +126,10 @@ class DeviceDataListView(generics.ListAPIView):
                 to_dt = to_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
             queryset = queryset.filter(timestamp__lte=to_dt)
 
+        # id breaks timestamp ties, so repeated exports and pages return rows in the same order
         if from_dt or to_dt:
-            return queryset.select_related('device').order_by('timestamp')
-        return queryset.select_related('device').order_by('-timestamp')
+            return queryset.select_related('device').order_by('timestamp', 'id')
+        return queryset.select_related('device').order_by('-timestamp', '-id')
 
 
 class DeviceDataLatestView(generics.GenericAPIView):
@@ -104,35 +140,58 @@ class DeviceDataLatestView(generics.GenericAPIView):
     """
     permission_classes = [IsAuthenticated]
 
-    def get_visible_device_ids(self):
-        user = self.request.user
-        if user.has_role('super_admin', 'admin'):
-            return list(Device.objects.all().values_list('id', flat=True))
-        return list(Device.objects.filter(assigned_users=user).values_list('id', flat=True))
+    def get_latest_rows(self):
+        """Newest DeviceData row per visible device (as a values() dict), in a single query."""
+        # Plain dicts: the response only needs these three columns, no model instances
+        rows = DeviceData.objects.values('device_id', 'parameters', 'timestamp')
+        if connection.vendor == 'postgresql':
+            # DISTINCT ON walks the (device, -timestamp) index once; the device filter is a
+            # flat id list (or none at all for admins)
+            return (
+                filter_visible_devices(rows, self.request)
+                .order_by('device_id', '-timestamp')
+                .distinct('device_id')
+            )
+        latest_id = DeviceData.objects.filter(
+            device_id=OuterRef('pk')
+        ).order_by('-timestamp').values('id')[:1]
+        visible = get_visible_devices_queryset(self.request.user)
+        return rows.filter(id__in=visible.annotate(latest_id=Subquery(latest_id)).values('latest_id'))
+
+    def get_version(self):
+        """
+        ETag and newest reading time for the visible devices, from one Max(timestamp) index scan.
+        The visible device set (ids for users, device count for admins) is part of the ETag so
+        assignment changes and device deletes also produce a new version, and the DeviceData
+        version counter so does any committed write, even one older than the newest reading.
+        """
+        device_ids = get_visible_device_ids(self.request)
+        last_modified = filter_visible_devices(DeviceData.objects.all(), self.request).aggregate(
+            last=Max('timestamp')
+        )['last']
+        visible = Device.objects.count() if device_ids is None else hashlib.md5(
+            ','.join(map(str, sorted(device_ids))).encode()
+        ).hexdigest()
+        etag = make_etag(
+            self.request.user.id,
+            last_modified.timestamp() if last_modified else 0,
+            visible,
+            get_device_data_version(),
+        )
+        return etag, last_modified
 
     def get(self, request):
-        device_ids = self.get_visible_device_ids()
-        if not device_ids:
-            return Response({})
-
-        latest_ts = DeviceData.objects.filter(
-            device_id__in=device_ids
-        ).values('device_id').annotate(latest_ts=Max('timestamp'))
-
-        pairs = [(row['device_id'], row['latest_ts']) for row in latest_ts]
-        if not pairs:
-            return Response({})
-
-        q = reduce(lambda a, b: a | b, [Q(device_id=d, timestamp=t) for d, t in pairs], Q())
-        rows = DeviceData.objects.filter(q).select_related('device')
+        etag, last_modified = self.get_version()
+        return conditional_response(request, etag, self.build_response, last_modified=last_modified)
 
+    def build_response(self):
         MAX_PARAMS = 20
-        result = {}
-        for row in rows:
-            params = row.parameters if isinstance(row.parameters, dict) else {}
-            items = list(params.items())[:MAX_PARAMS]
-            result[str(row.device_id)] = {
-                'parameters': dict(items),
-                'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+        result = {
+            str(row['device_id']): {
+                'parameters': dict(islice(row['parameters'].items(), MAX_PARAMS))
+                if isinstance(row['parameters'], dict) else {},
+                'timestamp': row['timestamp'].isoformat() if row['timestamp'] else None,
             }
+            for row in self.get_latest_rows()
+        }
         return Response(result)
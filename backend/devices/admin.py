@@ -1,3 +1,5 @@
+import json
+
 from django.contrib import admin
 from .models import Device, ParameterMapping, DeviceData
 
@@ -40,6 +42,7 @@ class ParameterMappingAdmin(admin.ModelAdmin):
 @admin.register(DeviceData)
 class DeviceDataAdmin(admin.ModelAdmin):
     list_display = ['device', 'timestamp', 'parameters_preview']
+    list_select_related = ['device']  # 'device' column renders Device.__str__ per row
     list_filter = ['timestamp', 'device']
     search_fields = ['device__name', 'device__hardware_address']
     readonly_fields = ['timestamp']
@@ -47,7 +50,6 @@ class DeviceDataAdmin(admin.ModelAdmin):
     
     def parameters_preview(self, obj):
         """Show a preview of parameters"""
-        import json
-        params = json.dumps(obj.parameters)[:100]
-        return params + '...' if len(json.dumps(obj.parameters)) > 100 else params
+        params = json.dumps(obj.parameters)
+        return params[:100] + '...' if len(params) > 100 else params
     parameters_preview.short_description = 'Parameters'
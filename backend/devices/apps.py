@@ -4,47 +4,45 @@ import time
 import sys
 from django.apps import AppConfig
 from django.conf import settings
+from django.utils.autoreload import DJANGO_AUTORELOAD_ENV
 
-# Ensure logger is configured
+# Handler and level come from settings.LOGGING ('devices' logger)
 logger = logging.getLogger(__name__)
-# Set level to INFO to ensure messages are visible
-if not logger.handlers:
-    handler = logging.StreamHandler()
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-logger.setLevel(logging.INFO)
 
 
 class DevicesConfig(AppConfig):
     name = 'devices'
     _mqtt_thread = None
     _mqtt_thread_lock = threading.Lock()
+    # Set by devices.signals whenever a Device is saved or deleted; wakes the re-subscribe loop
+    _resubscribe_event = threading.Event()
+    # Fallback re-check interval when no device change is signalled (catches queryset updates,
+    # retries failed brokers). Starts at the minimum after a change and doubles while idle.
+    RESUBSCRIBE_MIN_SECONDS = 5
+    RESUBSCRIBE_MAX_SECONDS = 300
 
     def ready(self):
         """Start MQTT subscriber automatically when Django is ready."""
         # Import signals to register them
         import devices.signals  # noqa
         
-        # Check if we're in the main process (not StatReloader child)
-        # StatReloader runs ready() in both parent and child processes
-        # We only want to start MQTT in the actual server process
-        import os
-        if os.environ.get('RUN_MAIN') != 'true':
-            # This is the parent process (StatReloader), skip
-            logger.debug('MQTT auto-start skipped: StatReloader parent process')
+        # The autoreloader runs ready() in both its watcher (parent) process and the server
+        # child it spawns (DJANGO_AUTORELOAD_ENV='true'); only the child may start MQTT.
+        # runserver --noreload has no parent, so it starts in its only process.
+        if self._is_reloader_parent():
+            logger.debug('MQTT auto-start skipped: autoreloader parent process')
             return
         
         # Log that ready() was called for debugging
-        logger.info(f'🔧 DevicesConfig.ready() called - sys.argv={sys.argv}')
+        logger.debug(f'🔧 DevicesConfig.ready() called - sys.argv={sys.argv}')
         
         # Always try to start unless explicitly blocked
         # This ensures it works even if runserver detection fails
         if self._should_start_mqtt_subscriber():
-            logger.info('🚀 MQTT auto-start check passed, scheduling subscriber startup in 2 seconds...')
-            # Delay start slightly to ensure database is ready
-            threading.Timer(2.0, self._start_mqtt_subscriber).start()
+            logger.info('🚀 MQTT auto-start check passed, starting subscriber thread...')
+            # No startup timer: the thread's django.setup() waits for the app registry to finish
+            # loading, and it waits for the database itself before the first query
+            self._start_mqtt_subscriber()
         else:
             # Log why it's not starting for debugging
             if 'migrate' in sys.argv or 'makemigrations' in sys.argv:
@@ -52,9 +50,19 @@ class DevicesConfig(AppConfig):
             elif 'test' in sys.argv:
                 logger.debug('MQTT auto-start skipped: test command')
             elif not getattr(settings, 'MQTT_AUTO_START', True):
-                logger.info('MQTT auto-start skipped: disabled in settings')
+                logger.debug('MQTT auto-start skipped: disabled in settings')
             else:
-                logger.warning(f'⚠️ MQTT auto-start skipped: sys.argv={sys.argv} - check _should_start_mqtt_subscriber logic')
+                logger.debug(f'MQTT auto-start skipped: not a runserver process, sys.argv={sys.argv}')
+
+    @staticmethod
+    def _is_reloader_parent():
+        """True in the file-watching parent of an autoreloading runserver (never serves requests)."""
+        import os
+        return (
+            os.environ.get(DJANGO_AUTORELOAD_ENV) != 'true'
+            and 'runserver' in sys.argv
+            and '--noreload' not in sys.argv
+        )
 
     def _should_start_mqtt_subscriber(self):
         """Check if MQTT subscriber should start automatically."""
@@ -63,12 +71,12 @@ class DevicesConfig(AppConfig):
         # Check if auto-start is enabled (default: True)
         auto_start = getattr(settings, 'MQTT_AUTO_START', True)
         if not auto_start:
-            logger.info('MQTT auto-start is disabled in settings')
+            logger.debug('MQTT auto-start is disabled in settings')
             return False
         
-        # If we're in StatReloader child process (RUN_MAIN='true'), we're likely running the server
+        # If we're in the autoreloader child process, we're likely running the server
         # In this case, be permissive unless explicitly blocked
-        is_reloader_child = os.environ.get('RUN_MAIN') == 'true'
+        is_reloader_child = os.environ.get(DJANGO_AUTORELOAD_ENV) == 'true'
         
         # Explicitly block certain commands that should never start MQTT
         blocking_commands = ['shell', 'shell_plus', 'migrate', 'makemigrations', 'test', 'collectstatic', 'createsuperuser', 'flush', 'dumpdata', 'loaddata', 'check', 'showmigrations', 'dbshell']
@@ -82,14 +90,14 @@ class DevicesConfig(AppConfig):
             logger.debug(f'MQTT auto-start allowed: runserver detected in sys.argv={sys.argv}')
             return True
         
-        # If we're in StatReloader child process and no blocking commands, start
-        # This handles the case where StatReloader child doesn't have 'runserver' in sys.argv
+        # If we're in the autoreloader child process and no blocking commands, start
+        # This handles the case where the child doesn't have 'runserver' in sys.argv
         if is_reloader_child:
-            logger.debug(f'MQTT auto-start allowed: StatReloader child process (RUN_MAIN=true), sys.argv={sys.argv}')
+            logger.debug(f'MQTT auto-start allowed: autoreloader child process ({DJANGO_AUTORELOAD_ENV}=true), sys.argv={sys.argv}')
             return True
         
         # Otherwise, don't start
-        logger.debug(f'MQTT auto-start blocked: not runserver and not StatReloader child, sys.argv={sys.argv}')
+        logger.debug(f'MQTT auto-start blocked: not runserver and not autoreloader child, sys.argv={sys.argv}')
         return False
 
     def _start_mqtt_subscriber(self):
@@ -118,11 +126,16 @@ class DevicesConfig(AppConfig):
                         is_active=True,
                         mqtt_broker_host__isnull=False
                     ).exclude(mqtt_broker_host='')
-                    
-                    device_count = devices_with_mqtt.count()
+
+                    def mqtt_config_snapshot():
+                        # One values_list scan; also the change-detection key for the loop below
+                        return frozenset(devices_with_mqtt.values_list('pk', 'mqtt_broker_host', 'mqtt_topic_pattern'))
+
+                    snapshot = mqtt_config_snapshot()
+                    device_count = len(snapshot)
                     logger.info(f'🔍 Found {device_count} device(s) with MQTT configuration')
                     
-                    if device_count > 0:
+                    if snapshot:
                         logger.info(
                             f'✅ Found {device_count} device(s) with per-device MQTT configuration. '
                             'Starting MQTT subscribers automatically...'
@@ -132,23 +145,28 @@ class DevicesConfig(AppConfig):
                         manager.subscribe_all_devices()
                         logger.info('✅ MQTT subscribers started automatically - data capture ACTIVE!')
                         
-                        # Keep thread alive and periodically check for new devices
-                        # Use shorter interval to catch new devices faster
+                        # Keep thread alive and re-subscribe when a Device changes (signalled by
+                        # devices.signals), or on an adaptive fallback interval: short right after a
+                        # change, backing off toward RESUBSCRIBE_MAX_SECONDS while nothing changes
+                        interval = self.RESUBSCRIBE_MIN_SECONDS
                         while True:
-                            time.sleep(10)  # Check every 10 seconds for new devices
+                            signalled = self._resubscribe_event.wait(timeout=interval)
+                            self._resubscribe_event.clear()
                             # Re-subscribe if needed (for new devices or configuration changes)
                             try:
-                                # Check for new devices
-                                current_devices = Device.objects.filter(
-                                    is_active=True,
-                                    mqtt_broker_host__isnull=False
-                                ).exclude(mqtt_broker_host='')
-                                
-                                if current_devices.count() != device_count:
-                                    logger.info(f'Device count changed ({device_count} -> {current_devices.count()}), re-subscribing all devices')
-                                    device_count = current_devices.count()
-                                
-                                manager.subscribe_all_devices()
+                                current = mqtt_config_snapshot()
+                                if signalled or current != snapshot:
+                                    if current != snapshot:
+                                        logger.info(f'MQTT device configuration changed ({len(snapshot)} -> {len(current)} device(s)), re-subscribing all devices')
+                                    snapshot = current
+                                    interval = self.RESUBSCRIBE_MIN_SECONDS
+                                else:
+                                    interval = min(interval * 2, self.RESUBSCRIBE_MAX_SECONDS)
+
+                                if manager.subscribe_all_devices():
+                                    # A broker group failed to connect/subscribe: keep retrying at the
+                                    # short interval instead of backing off while nothing changes
+                                    interval = self.RESUBSCRIBE_MIN_SECONDS
                             except Exception as e:
                                 logger.error(f'Error re-subscribing devices: {e}', exc_info=True)
                     else:
@@ -2,13 +2,18 @@
 Module 4: 15-day data retention.
 Deletes DeviceData older than 15 days. Run daily via cron:
   python manage.py cleanup_old_device_data
+On PostgreSQL with TimescaleDB, where device_data has been converted to a hypertable once
+(SELECT create_hypertable('device_data', 'timestamp', migrate_data => true); this also needs
+the primary key to include timestamp), pass --timescale to drop whole expired chunks instead.
 """
 from datetime import timedelta
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
 from django.utils import timezone
 
 from devices.models import DeviceData
+from devices.services import bump_device_data_version
 
 
 class Command(BaseCommand):
@@ -26,6 +31,11 @@ class Command(BaseCommand):
             action='store_true',
             help='Only report how many rows would be deleted',
         )
+        parser.add_argument(
+            '--timescale',
+            action='store_true',
+            help='Drop expired TimescaleDB chunks of the device_data hypertable instead of deleting rows',
+        )
 
     def handle(self, *args, **options):
         days = options['days']
@@ -33,17 +43,42 @@ class Command(BaseCommand):
         cutoff = timezone.now() - timedelta(days=days)
 
         qs = DeviceData.objects.filter(timestamp__lt=cutoff)
-        count = qs.count()
 
-        if count == 0:
-            self.stdout.write(self.style.SUCCESS(f'No device data older than {days} days.'))
+        if options['timescale'] and not dry_run:
+            self.drop_chunks(cutoff, days)
+            bump_device_data_version()
             return
 
         if dry_run:
+            count = qs.count()
+            if count == 0:
+                self.stdout.write(self.style.SUCCESS(f'No device data older than {days} days.'))
+                return
             self.stdout.write(
                 self.style.WARNING(f'Would delete {count} device data record(s) older than {days} days.')
             )
             return
 
-        qs.delete()
+        # Nothing references DeviceData and it has no delete signals, so Django issues a single
+        # DELETE ... WHERE timestamp < cutoff (no primary keys loaded) and returns the row count
+        count, _ = qs.delete()
+        if count:
+            bump_device_data_version()
+        if count == 0:
+            self.stdout.write(self.style.SUCCESS(f'No device data older than {days} days.'))
+            return
         self.stdout.write(self.style.SUCCESS(f'Deleted {count} device data record(s) older than {days} days.'))
+
+    def drop_chunks(self, cutoff, days):
+        """Drop whole hypertable chunks older than cutoff: a metadata operation, no per-row DELETE or vacuum."""
+        if connection.vendor != 'postgresql':
+            raise CommandError('--timescale requires PostgreSQL with the TimescaleDB extension.')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT drop_chunks(%s, older_than => %s)',
+                [DeviceData._meta.db_table, cutoff],
+            )
+            dropped = cursor.fetchall()
+        self.stdout.write(self.style.SUCCESS(
+            f'Dropped {len(dropped)} device data chunk(s) older than {days} days.'
+        ))
@@ -5,20 +5,22 @@ Supports per-device MQTT configuration or global configuration fallback.
 Config: MQTT_BROKER_HOST (default localhost), MQTT_BROKER_PORT (default 1883), MQTT_TOPIC_PREFIX (default EM).
 Run: python manage.py run_mqtt_subscriber
 """
-import json
 import logging
 import os
 import sys
 import signal
+import threading
 
+import orjson
 import paho.mqtt.client as mqtt
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
-from devices.models import Device, DeviceData
-from devices.services import check_thresholds_and_create_alarms
+from devices.models import Device
+from devices.services import check_thresholds_async, get_device_data_writer, numeric_parameters
 from devices.mqtt_service import get_mqtt_connection_manager
+from devices.routing import device_router
 
 
 logger = logging.getLogger(__name__)
@@ -71,12 +73,13 @@ class Command(BaseCommand):
             
             manager = get_mqtt_connection_manager()
             
+            # Set by the signal handlers; the main thread blocks on it instead of polling
+            stop_event = threading.Event()
+            
             # Set up signal handlers for graceful shutdown (only in interactive mode)
             if hasattr(self, '_called_from_command_line') or sys.stdin.isatty():
                 def signal_handler(sig, frame):
-                    self.stdout.write(self.style.WARNING('\nShutting down MQTT subscribers...'))
-                    manager.disconnect_all()
-                    sys.exit(0)
+                    stop_event.set()
                 
                 signal.signal(signal.SIGINT, signal_handler)
                 signal.signal(signal.SIGTERM, signal_handler)
@@ -88,17 +91,16 @@ class Command(BaseCommand):
             if sys.stdin.isatty():
                 self.stdout.write('Press Ctrl+C to stop.')
             
-            # Keep running
+            # Keep running until a signal arrives (no periodic wake-ups)
             try:
-                import time
-                while True:
-                    time.sleep(1)
+                stop_event.wait()
             except (KeyboardInterrupt, SystemExit):
-                if hasattr(self, '_called_from_command_line') or sys.stdin.isatty():
-                    self.stdout.write(self.style.WARNING('\nShutting down MQTT subscribers...'))
-                manager.disconnect_all()
-                if sys.stdin.isatty():
-                    sys.exit(0)
+                pass
+            if hasattr(self, '_called_from_command_line') or sys.stdin.isatty():
+                self.stdout.write(self.style.WARNING('\nShutting down MQTT subscribers...'))
+            manager.disconnect_all()
+            if sys.stdin.isatty():
+                sys.exit(0)
         else:
             # Fall back to global configuration (backward compatibility)
             self.stdout.write(
@@ -106,19 +108,19 @@ class Command(BaseCommand):
                 f'Using global configuration: {host}:{port}, topic prefix "{prefix}"'
             )
             
-            addresses = list(
-                Device.objects.filter(is_active=True).values_list('hardware_address', flat=True).distinct()
-            )
-            if not addresses:
+            active = Device.objects.filter(is_active=True)
+            if not active.exists():
                 self.stdout.write(self.style.WARNING('No active devices; nothing to subscribe to.'))
                 return
 
-            # Subscribe to both exact topics and wildcard pattern
-            topics = [f'{prefix}/{hw}' for hw in addresses]
-            # Also subscribe to wildcard pattern to catch any device (including alphanumeric topics)
-            wildcard_topic = f'{prefix}/+'
-            if wildcard_topic not in topics:
-                topics.append(wildcard_topic)
+            # One wildcard covers every single-level EM/{hardware_address}; the device router resolves
+            # the address per message. Only addresses spanning several topic levels need their own topic.
+            topics = [f'{prefix}/+']
+            topics += [
+                f'{prefix}/{hw}'
+                for hw in active.filter(hardware_address__contains='/')
+                .values_list('hardware_address', flat=True).distinct().iterator(chunk_size=1000)
+            ]
             self.stdout.write(f'Subscribing to {len(topics)} topic(s): {", ".join(topics[:5])}{"..." if len(topics) > 5 else ""}')
             self.stdout.write(self.style.WARNING(
                 'Note: Using wildcard subscription to catch all topics. '
@@ -157,114 +159,50 @@ class Command(BaseCommand):
         def on_message(client, userdata, msg):
             try:
                 topic = msg.topic
-                logger.info(f'Received MQTT message on topic: {topic}')
+                logger.debug('Received MQTT message on topic: %s', topic)
                 
-                # First, try to find device by exact topic pattern match
-                device = Device.objects.filter(
-                    mqtt_topic_pattern=topic,
-                    is_active=True
-                ).first()
-                
-                # If not found by topic pattern, try to match by hardware address extraction
-                if not device and topic_prefix:
-                    parts = topic.split('/', 1)
-                    if len(parts) > 1:
-                        potential_hw = parts[-1]
-                        # Try exact match first
-                        device = Device.objects.filter(
-                            hardware_address=potential_hw,
-                            is_active=True
-                        ).first()
-                        
-                        # If still not found and it's alphanumeric, try matching any device with this topic pattern
-                        if not device:
-                            # Check if any device has this topic pattern configured
-                            device = Device.objects.filter(
-                                mqtt_topic_pattern__isnull=False
-                            ).exclude(mqtt_topic_pattern='').filter(
-                                is_active=True
-                            ).first()
-                            # If found, check if topic matches the pattern (simple substring match)
-                            if device and device.mqtt_topic_pattern:
-                                if device.mqtt_topic_pattern in topic or topic.endswith(device.mqtt_topic_pattern.split('/')[-1]):
-                                    pass  # Use this device
-                                else:
-                                    device = None
-                
-                # Last resort: try to match by extracting hardware address from topic
-                if not device:
-                    if topic_prefix:
-                        parts = topic.split('/', 1)
-                        hardware_address = parts[-1] if len(parts) > 1 else topic
-                    else:
-                        hardware_address = topic
-                    
-                    # Try to find device by hardware address
-                    device = Device.objects.filter(
-                        hardware_address=hardware_address,
-                        is_active=True
-                    ).first()
-                    
-                    # If hardware_address doesn't match exactly, try partial match
-                    if not device and len(hardware_address) >= 3:
-                        # Try to find device where hardware_address is contained in topic suffix
-                        devices = Device.objects.filter(is_active=True)
-                        for d in devices:
-                            if hardware_address.endswith(d.hardware_address) or d.hardware_address in hardware_address:
-                                device = d
-                                logger.info(f'Matched device {d.name} ({d.hardware_address}) to topic {topic} via partial match')
-                                break
-                    
-                    # If still no match and only one active device, use it (fallback for testing)
-                    if not device:
-                        active_devices = list(Device.objects.filter(is_active=True))
-                        if len(active_devices) == 1:
-                            device = active_devices[0]
-                            logger.warning(
-                                f'No exact match for topic {topic}, but only one active device found. '
-                                f'Using device {device.name} ({device.hardware_address}). '
-                                f'Consider setting mqtt_topic_pattern="{topic}" for this device.'
-                            )
-
-                if not device:
-                    available_devices = Device.objects.filter(is_active=True).values_list('id', 'name', 'hardware_address', 'mqtt_topic_pattern')
-                    device_list = ', '.join([f'{d[1]} (HW: {d[2]}, Topic: {d[3] or "Not set"})' for d in available_devices])
+                # Resolved from the in-process device table: no queries per message
+                device, matched_by = device_router.match(topic, topic_prefix)
+                if matched_by == 'partial':
+                    logger.debug('Matched device %s (%s) to topic %s via partial match', device.name, device.hardware_address, topic)
+                elif matched_by == 'only_active' and device_router.should_warn(topic):
                     logger.warning(
-                        f'No active device found for topic: {topic}\n'
-                        f'Available devices: {device_list}\n'
-                        f'To fix: Set mqtt_topic_pattern="{topic}" for the correct device via device edit or API.'
+                        'No exact match for topic %s, but only one active device found. '
+                        'Using device %s (%s). Consider setting mqtt_topic_pattern="%s" for this device.',
+                        topic, device.name, device.hardware_address, topic
                     )
+
+                if not device:
+                    if device_router.should_warn(topic):
+                        logger.warning(
+                            'No active device found for topic: %s\nAvailable devices: %s\n'
+                            'To fix: Set mqtt_topic_pattern="%s" for the correct device via device edit or API.',
+                            topic, device_router.describe(), topic
+                        )
                     return
 
-                payload = msg.payload.decode('utf-8')
-                logger.debug(f'Processing payload for device {device.name} ({device.hardware_address}): {payload[:200]}')
-                
-                data = json.loads(payload)
+                logger.debug('Processing payload for device %s (%s): %r', device.name, device.hardware_address, msg.payload[:200])
+
+                # orjson parses the raw bytes directly (no intermediate str)
+                data = orjson.loads(msg.payload)
                 if not isinstance(data, dict):
                     logger.warning('Ignoring non-dict payload on %s', topic)
                     return
 
-                # Normalize to dict of numbers for storage
-                parameters = {}
-                for k, v in data.items():
-                    if isinstance(v, (int, float)):
-                        parameters[str(k)] = v
-                    elif isinstance(v, str) and v.replace('.', '', 1).replace('-', '', 1).isdigit():
-                        try:
-                            parameters[str(k)] = float(v)
-                        except ValueError:
-                            pass
+                parameters = numeric_parameters(data)
 
                 if not parameters:
                     logger.warning('No numeric parameters in payload on %s', topic)
                     return
 
-                device_data = DeviceData.objects.create(device=device, parameters=parameters)
-                device.last_data_received = device_data.timestamp
-                device.save(update_fields=['last_data_received'])
-                check_thresholds_and_create_alarms(device, parameters)
-                logger.info(f'Stored data for device {device.name} ({device.hardware_address}) from topic {topic}: {len(parameters)} parameters')
-            except json.JSONDecodeError as e:
+                # Buffered: stored with the next bulk_create batch, not on this callback thread
+                if not get_device_data_writer().add(device, parameters):
+                    # Same values as the last stored reading: nothing new to store or check
+                    return
+                check_thresholds_async(device, parameters)
+                logger.debug('Queued data for device %s (%s) from topic %s: %d parameters',
+                             device.name, device.hardware_address, topic, len(parameters))
+            except orjson.JSONDecodeError as e:
                 logger.warning('Invalid JSON on %s: %s', msg.topic, e)
             except Exception as e:
                 logger.exception('Error processing message on %s: %s', msg.topic, e)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-14 05:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0004_device_hardware_address_flexible'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alarm',
+            index=models.Index(fields=['device', 'acknowledged', '-timestamp'], name='alarms_device__836a07_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alarm',
+            index=models.Index(fields=['-timestamp'], name='alarms_timesta_3ad02b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alarm',
+            index=models.Index(condition=models.Q(('acknowledged', False)), fields=['device', 'parameter_key'], name='alarm_unacknowledged_idx'),
+        ),
+    ]
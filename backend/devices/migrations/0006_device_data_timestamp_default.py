@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-14 05:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0005_alarm_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='devicedata',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-14 07:00
+
+import core.encoders
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0006_device_data_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='devicedata',
+            name='parameters',
+            field=models.JSONField(encoder=core.encoders.OrjsonJSONEncoder, help_text='JSON data from device (e.g., {"v": 230, "a": 5})'),
+        ),
+    ]
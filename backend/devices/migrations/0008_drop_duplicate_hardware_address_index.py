@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-14 05:54
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_devicedata_parameters_orjson_encoder'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='device',
+            name='devices_hardwar_f7c56a_idx',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-14 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0008_drop_duplicate_hardware_address_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alarm',
+            index=models.Index(condition=models.Q(('acknowledged', False)), fields=['-timestamp'], name='alarm_unack_recent_idx'),
+        ),
+    ]
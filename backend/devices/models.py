@@ -1,5 +1,7 @@
 from django.db import models
+from django.utils import timezone
 from accounts.models import User
+from core.encoders import OrjsonJSONEncoder
 
 
 class Device(models.Model):
@@ -89,8 +91,8 @@ class Device(models.Model):
         verbose_name = 'Device'
         verbose_name_plural = 'Devices'
         ordering = ['-created_at']
+        # hardware_address needs no extra index: unique=True already creates one
         indexes = [
-            models.Index(fields=['hardware_address']),
             models.Index(fields=['is_active']),
             models.Index(fields=['area', 'building', 'floor']),
         ]
@@ -147,9 +149,11 @@ class DeviceData(models.Model):
         related_name='data_records'
     )
     parameters = models.JSONField(
+        encoder=OrjsonJSONEncoder,
         help_text='JSON data from device (e.g., {"v": 230, "a": 5})'
     )
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # default instead of auto_now_add so buffered MQTT writes keep their receive time through bulk_create
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         db_table = 'device_data'
@@ -227,6 +231,23 @@ class Alarm(models.Model):
         verbose_name = 'Alarm'
         verbose_name_plural = 'Alarms'
         ordering = ['-timestamp']
+        indexes = [
+            # AlarmListView: filter by device / acknowledged, newest first
+            models.Index(fields=['device', 'acknowledged', '-timestamp']),
+            models.Index(fields=['-timestamp']),
+            # Open-alarm lookup before creating a new alarm (check_thresholds_and_create_alarms)
+            models.Index(
+                fields=['device', 'parameter_key'],
+                condition=models.Q(acknowledged=False),
+                name='alarm_unacknowledged_idx',
+            ),
+            # "Active alarms" across all devices (?acknowledged=false without device_id), newest first
+            models.Index(
+                fields=['-timestamp'],
+                condition=models.Q(acknowledged=False),
+                name='alarm_unack_recent_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.device.name} {self.parameter_key} {self.type} breach"
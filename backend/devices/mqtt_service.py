@@ -1,47 +1,221 @@
 """
 MQTT Service - Centralized MQTT connection management with per-device broker support.
 Supports dynamic subscription/unsubscription and handles per-device broker configurations.
+All broker clients share one network thread (SharedNetworkLoop) rather than one loop_start() thread each.
 """
-import json
+import functools
 import logging
+import select
+import socket
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Set
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
+import orjson
 import paho.mqtt.client as mqtt
 
-from .models import Device, DeviceData
-from .services import check_thresholds_and_create_alarms
+from .models import Device
+from .routing import device_router
+from .services import check_thresholds_async, configure_mqtt_tls, get_device_data_writer, numeric_parameters
 
 logger = logging.getLogger(__name__)
-# Ensure logger level is set to INFO for visibility
-logger.setLevel(logging.INFO)
+
+# Max seconds _get_client waits for the broker's CONNACK before returning the client
+CONNECT_WAIT_SECONDS = 5.0
+
+
+def _locked(method):
+    """Run an MQTTConnectionManager method under the manager's lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class SharedNetworkLoop:
+    """
+    Drives the socket I/O of every broker client from one thread, using paho's external-loop
+    API (loop_read/loop_write/loop_misc) instead of a loop_start() thread per client.
+    Lost connections are retried with the same back-off paho uses (1s doubling to 120s); the
+    blocking reconnect() runs on its own short-lived thread so one unreachable broker never
+    stalls the others.
+    """
+    RECONNECT_MIN_SECONDS = 1
+    RECONNECT_MAX_SECONDS = 120
+
+    def __init__(self):
+        self._clients: Dict[mqtt.Client, dict] = {}  # client -> {'closing', 'retry_at', 'delay'}
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._thread: Optional[threading.Thread] = None
+
+    def wake(self, *args):
+        """Interrupt select() so new sockets / queued packets are picked up immediately."""
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def add(self, client: mqtt.Client) -> None:
+        """Register a connected client (after client.connect()); later packets wake the loop."""
+        client.on_socket_register_write = self.wake
+        with self._lock:
+            self._clients[client] = {
+                'closing': False, 'reconnecting': False, 'retry_at': 0.0, 'delay': self.RECONNECT_MIN_SECONDS,
+            }
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='mqtt-network', daemon=True)
+                self._thread.start()
+        self.wake()
+
+    def remove(self, client: mqtt.Client) -> None:
+        """Stop reconnecting a client; it is dropped once its DISCONNECT is flushed and the socket closes."""
+        with self._lock:
+            state = self._clients.get(client)
+            if state is not None:
+                state['closing'] = True
+        self.wake()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._iterate()
+            except Exception as e:
+                # Nothing may end this thread: every broker client depends on it
+                logger.error(f"MQTT network loop error: {e}", exc_info=True)
+                time.sleep(self.RECONNECT_MIN_SECONDS)
+
+    def _iterate(self) -> None:
+        """One select() round over every client socket, then keepalives and due reconnects."""
+        with self._lock:
+            clients = list(self._clients.items())
+        socks = {}
+        for client, state in clients:
+            sock = client.socket()
+            if sock is not None:
+                socks[sock] = client
+            elif state['closing']:
+                with self._lock:
+                    self._clients.pop(client, None)
+        readable = [self._wake_r, *socks]
+        writable = [sock for sock, client in socks.items() if client.want_write()]
+        # TLS sockets can hold decrypted data that select() does not report
+        pending = [sock for sock in socks if getattr(sock, 'pending', None) and sock.pending()]
+        try:
+            r, w, _ = select.select(readable, writable, [], 0 if pending else 1.0)
+        except (OSError, ValueError):
+            # A socket was closed under us; rebuild the lists
+            return
+        if self._wake_r in r:
+            try:
+                while self._wake_r.recv(512):
+                    pass
+            except (BlockingIOError, OSError):
+                pass
+        for sock in set(r).union(pending):
+            client = socks.get(sock)
+            if client is not None:
+                self._step(client.loop_read)
+        for sock in w:
+            client = socks.get(sock)
+            if client is not None and client.socket() is sock:
+                self._step(client.loop_write)
+        now = time.monotonic()
+        for client, state in clients:
+            if client.socket() is not None:
+                self._step(client.loop_misc)
+                state['delay'] = self.RECONNECT_MIN_SECONDS
+            elif not state['closing'] and not state['reconnecting'] and now >= state['retry_at']:
+                self._reconnect(client, state, now)
+
+    @staticmethod
+    def _step(call) -> None:
+        # A callback error must not stop the I/O thread shared by every broker
+        try:
+            call()
+        except Exception as e:
+            logger.error(f"MQTT network loop error: {e}", exc_info=True)
+
+    def _reconnect(self, client: mqtt.Client, state: dict, now: float) -> None:
+        state['reconnecting'] = True
+        state['retry_at'] = now + state['delay']
+        state['delay'] = min(state['delay'] * 2, self.RECONNECT_MAX_SECONDS)
+
+        def reconnect():
+            # DNS lookup and TCP/TLS connect block for up to the socket timeout
+            try:
+                client.reconnect()
+                logger.info(f"Reconnecting to MQTT broker {client.host}:{client.port}")
+            except Exception as e:
+                logger.warning(f"Reconnect to MQTT broker {client.host}:{client.port} failed: {e}")
+            finally:
+                state['reconnecting'] = False
+                self.wake()  # pick up the new socket
+
+        threading.Thread(target=reconnect, name='mqtt-reconnect', daemon=True).start()
 
 
 class MQTTConnectionManager:
     """Manages MQTT connections for multiple brokers with per-device configurations."""
     
     def __init__(self):
-        self.clients: Dict[str, mqtt.Client] = {}  # Key: "{host}:{port}"
-        self.subscribed_topics: Dict[str, Set[str]] = defaultdict(set)  # Key: "{host}:{port}", Value: set of topics
+        self.clients: Dict[str, mqtt.Client] = {}  # Key: "[{username}@]{host}:{port}"
+        self.subscribed_topics: Dict[str, Set[str]] = defaultdict(set)  # Key: broker key, Value: set of topics
         self.device_topic_map: Dict[str, int] = {}  # Key: topic, Value: device_id
+        self._network = SharedNetworkLoop()  # one I/O thread for all broker clients
+        self._connected_events: Dict[str, threading.Event] = {}  # Key: broker key, set on CONNACK
+        # Client and subscription changes come from the mqtt-subscribe worker (saves), the
+        # re-subscribe thread and request threads (deletes); without this two of them could each
+        # create a client for the same broker and every message would be ingested twice.
+        # Re-entrant because the public methods call _get_client.
+        self._lock = threading.RLock()
     
-    def _get_broker_key(self, host: str, port: int) -> str:
-        """Generate unique key for broker."""
-        return f"{host}:{port}"
+    def _get_broker_key(self, host: str, port: int, username: Optional[str] = None) -> str:
+        """Generate unique key for a broker connection (one client per host, port and username)."""
+        return f"{username}@{host}:{port}" if username else f"{host}:{port}"
+
+    @staticmethod
+    def _shared_group() -> str:
+        return getattr(settings, 'MQTT_SHARED_SUBSCRIPTION_GROUP', '')
+    
+    def _subscription_filter(self, topic: str) -> str:
+        """
+        Filter actually sent to the broker for a device topic pattern. With
+        MQTT_SHARED_SUBSCRIPTION_GROUP set, "$share/<group>/<pattern>" so the broker delivers each
+        message to one subscriber of the group (plain topic still arrives in on_message).
+        """
+        group = self._shared_group()
+        if group and not topic.startswith('$share/'):
+            return f"$share/{group}/{topic}"
+        return topic
     
+    def _device_broker_key(self, device: Device) -> str:
+        return self._get_broker_key(device.mqtt_broker_host or '', device.mqtt_broker_port or 1883,
+                                    device.mqtt_username or None)
+    
+    @_locked
     def _get_client(self, host: str, port: int, username: Optional[str] = None,
                    password: Optional[str] = None, use_tls: bool = False,
                    tls_ca_certs: Optional[str] = None) -> mqtt.Client:
         """Get or create MQTT client for a broker."""
-        broker_key = self._get_broker_key(host, port)
+        broker_key = self._get_broker_key(host, port, username)
         
         if broker_key in self.clients:
             return self.clients[broker_key]
         
         # Create new client
         try:
-            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+            # Shared subscriptions ($share/...) are an MQTT 5 feature
+            protocol = mqtt.MQTTv5 if self._shared_group() else mqtt.MQTTv311
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=protocol)
         except AttributeError:
             client = mqtt.Client()
         
@@ -51,167 +225,123 @@ class MQTTConnectionManager:
         
         # Configure TLS
         if use_tls:
-            if tls_ca_certs:
-                import os
-                if os.path.exists(tls_ca_certs):
-                    client.tls_set(ca_certs=tls_ca_certs)
-                else:
-                    # Treat as certificate content
-                    import tempfile
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.pem') as f:
-                        f.write(tls_ca_certs)
-                        temp_cert_path = f.name
-                    client.tls_set(ca_certs=temp_cert_path)
-            else:
-                client.tls_set()
-        
-        # Set up callbacks
-        def on_connect(client, userdata, flags, reason_code, properties=None):
-            rc = getattr(reason_code, 'value', reason_code) if reason_code is not None else 0
-            if rc == 0:
-                logger.info(f"✓ Connected to MQTT broker {broker_key}")
-                # Resubscribe to all topics for this broker.
-                # Copy to list to avoid 'Set changed size during iteration' errors
-                topics = list(self.subscribed_topics[broker_key])
-                if topics:
-                    logger.info(f"Resubscribing to {len(topics)} topic(s) on {broker_key}")
-                    for topic in topics:
-                        result = client.subscribe(topic)
-                        if result and result[0] == mqtt.MQTT_ERR_SUCCESS:
-                            logger.debug(f"✓ Resubscribed to {topic}")
-                        else:
-                            logger.warning(f"Failed to resubscribe to {topic}: {result}")
-                else:
-                    logger.info(f"No topics to resubscribe on {broker_key}")
-            else:
-                logger.error(f"✗ Failed to connect to MQTT broker {broker_key}: {reason_code}")
+            configure_mqtt_tls(client, tls_ca_certs)
         
-        def on_message(client, userdata, msg):
-            self._handle_message(msg)
-        
-        def on_disconnect(client, userdata, flags, reason_code, properties=None):
-            logger.warning(f"Disconnected from MQTT broker {broker_key}: {reason_code}")
-        
-        client.on_connect = on_connect
-        client.on_message = on_message
-        client.on_disconnect = on_disconnect
+        # Bound-method callbacks shared by every client; the broker key travels as paho userdata
+        client.user_data_set(broker_key)
+        connected = self._connected_events.setdefault(broker_key, threading.Event())
+        connected.clear()
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        client.on_disconnect = self._on_disconnect
         
         # Connect
         try:
             logger.info(f"Connecting to MQTT broker {broker_key}...")
             client.connect(host, port, 60)
-            client.loop_start()
+            self._network.add(client)
             self.clients[broker_key] = client
             logger.info(f"✓ Created MQTT client for {broker_key}, connection in progress...")
-            # Give connection a moment to establish
-            import time
-            time.sleep(0.5)
+            # Return as soon as CONNACK arrives; on timeout, topics are still sent from on_connect
+            if not connected.wait(timeout=CONNECT_WAIT_SECONDS):
+                logger.warning(f"No CONNACK from {broker_key} after {CONNECT_WAIT_SECONDS}s; subscriptions will be sent on connect")
         except Exception as e:
             logger.error(f"✗ Failed to connect to MQTT broker {broker_key}: {e}", exc_info=True)
             raise
         
         return client
     
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        broker_key = userdata
+        rc = getattr(reason_code, 'value', reason_code) if reason_code is not None else 0
+        if rc == 0:
+            logger.info(f"✓ Connected to MQTT broker {broker_key}")
+            event = self._connected_events.get(broker_key)
+            if event is not None:
+                event.set()
+            # Resubscribe to all topics for this broker.
+            # Copy to list to avoid 'Set changed size during iteration' errors
+            topics = list(self.subscribed_topics[broker_key])
+            if topics:
+                logger.info(f"Resubscribing to {len(topics)} topic(s) on {broker_key}")
+                # One SUBSCRIBE packet for every topic on this connection
+                result = client.subscribe([(topic, 0) for topic in topics])
+                if result and result[0] == mqtt.MQTT_ERR_SUCCESS:
+                    logger.debug(f"✓ Resubscribed to {len(topics)} topic(s) on {broker_key}")
+                else:
+                    logger.warning(f"Failed to resubscribe on {broker_key}: {result}")
+            else:
+                logger.info(f"No topics to resubscribe on {broker_key}")
+        else:
+            logger.error(f"✗ Failed to connect to MQTT broker {broker_key}: {reason_code}")
+    
+    def _on_message(self, client, userdata, msg):
+        self._handle_message(msg)
+    
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        event = self._connected_events.get(userdata)
+        if event is not None:
+            event.clear()
+        logger.warning(f"Disconnected from MQTT broker {userdata}: {reason_code}")
+    
     def _handle_message(self, msg):
         """Handle incoming MQTT message."""
         try:
             topic = msg.topic
-            logger.info(f'📨 Received MQTT message on topic: {topic} (payload length: {len(msg.payload)} bytes)')
-            
-            # Find device by topic mapping (exact match)
-            device_id = self.device_topic_map.get(topic)
-            device = None
-            
-            if device_id:
-                device = Device.objects.filter(id=device_id, is_active=True).first()
+            logger.debug('📨 Received MQTT message on topic: %s (payload length: %d bytes)', topic, len(msg.payload))
             
-            # If not found by exact topic match, try pattern matching
-            if not device:
-                # Try to find device by topic pattern (supports wildcards)
-                devices_with_mqtt = Device.objects.filter(
-                    is_active=True,
-                    mqtt_topic_pattern__isnull=False
-                ).exclude(mqtt_topic_pattern='')
-                
-                for d in devices_with_mqtt:
-                    pattern = d.mqtt_topic_pattern
-                    # Exact match
-                    if pattern == topic:
-                        device = d
-                        logger.info(f'Matched device {d.name} by exact topic pattern: {pattern}')
-                        break
-                    # Wildcard match: if pattern ends with +, match prefix
-                    elif pattern.endswith('+') and topic.startswith(pattern[:-1]):
-                        device = d
-                        logger.info(f'Matched device {d.name} by wildcard pattern: {pattern}')
-                        break
-                    # Suffix match: if topic ends with hardware_address
-                    elif topic.endswith(d.hardware_address):
-                        device = d
-                        logger.info(f'Matched device {d.name} by hardware address suffix: {d.hardware_address}')
-                        break
+            # Resolved from the in-process device table: no queries per message
+            device, matched_by = device_router.match_subscription(topic)
+            if matched_by == 'wildcard':
+                logger.debug('Matched device %s to topic %s by %s: %s', device.name, topic, matched_by, device.mqtt_topic_pattern)
+            elif matched_by == 'only_active' and device_router.should_warn(topic):
+                logger.warning(
+                    'No exact match for topic %s, but only one active device found. '
+                    'Using device %s (%s). Consider setting mqtt_topic_pattern="%s" for this device.',
+                    topic, device.name, device.hardware_address, topic
+                )
             
-            # Last resort: if only one active device and no topic pattern match, use it
             if not device:
-                active_devices = list(Device.objects.filter(is_active=True))
-                if len(active_devices) == 1:
-                    device = active_devices[0]
+                if device_router.should_warn(topic):
                     logger.warning(
-                        f'No exact match for topic {topic}, but only one active device found. '
-                        f'Using device {device.name} ({device.hardware_address}). '
-                        f'Consider setting mqtt_topic_pattern="{topic}" for this device.'
+                        'No device found for topic: %s\nMapped topics: %s\nAvailable devices: %s\n'
+                        'To fix: Set mqtt_topic_pattern="%s" for the correct device.',
+                        topic, list(self.device_topic_map), device_router.describe(), topic
                     )
-            
-            if not device:
-                available_devices = Device.objects.filter(is_active=True).values_list('id', 'name', 'hardware_address', 'mqtt_topic_pattern')
-                device_list = ', '.join([f'{d[1]} (HW: {d[2]}, Topic: {d[3] or "Not set"})' for d in available_devices])
-                logger.warning(
-                    f'No device found for topic: {topic}\n'
-                    f'Mapped topics: {list(self.device_topic_map.keys())}\n'
-                    f'Available devices: {device_list}\n'
-                    f'To fix: Set mqtt_topic_pattern="{topic}" for the correct device.'
-                )
                 return
             
-            # Parse payload
-            payload = msg.payload.decode('utf-8')
+            # Parse payload (orjson reads the bytes directly, no decode step)
             try:
-                data = json.loads(payload)
+                data = orjson.loads(msg.payload)
                 if not isinstance(data, dict):
-                    logger.warning(f'Ignoring non-dict payload on {topic}')
+                    logger.warning('Ignoring non-dict payload on %s', topic)
                     return
-            except json.JSONDecodeError as e:
-                logger.warning(f'Invalid JSON on {topic}: {e}')
+            except orjson.JSONDecodeError as e:
+                logger.warning('Invalid JSON on %s: %s', topic, e)
                 return
             
             # Normalize to dict of numbers
-            parameters = {}
-            for k, v in data.items():
-                if isinstance(v, (int, float)):
-                    parameters[str(k)] = v
-                elif isinstance(v, str) and v.replace('.', '', 1).replace('-', '', 1).isdigit():
-                    try:
-                        parameters[str(k)] = float(v)
-                    except ValueError:
-                        pass
+            parameters = numeric_parameters(data)
             
             if not parameters:
-                logger.warning(f'No numeric parameters in payload on {topic}')
+                logger.warning('No numeric parameters in payload on %s', topic)
                 return
             
-            # Store device data
-            device_data = DeviceData.objects.create(device=device, parameters=parameters)
-            device.last_data_received = device_data.timestamp
-            device.save(update_fields=['last_data_received'])
+            # Buffered: stored with the next bulk_create batch, not on the paho network thread
+            if not get_device_data_writer().add(device, parameters):
+                # Same values as the last stored reading: nothing new to store or check
+                return
             
-            # Check thresholds and create alarms
-            check_thresholds_and_create_alarms(device, parameters)
+            # Alarm check runs on the threshold worker, off the network thread
+            check_thresholds_async(device, parameters)
             
-            logger.info(f'💾 Stored data for device {device.name} ({device.hardware_address}) from topic {topic}: {len(parameters)} parameters - {device_data.timestamp}')
+            logger.debug('💾 Queued data for device %s (%s) from topic %s: %d parameters - %s',
+                         device.name, device.hardware_address, topic, len(parameters), device.last_data_received)
             
         except Exception as e:
-            logger.exception(f'Error processing message on {msg.topic}: {e}')
+            logger.exception('Error processing message on %s: %s', msg.topic, e)
     
+    @_locked
     def subscribe_device(self, device: Device):
         """Subscribe to MQTT topic for a device. Creates client and connection if needed."""
         if not device.is_active:
@@ -235,27 +365,22 @@ class MQTTConnectionManager:
             )
             
             topic = device.mqtt_topic_pattern
-            broker_key = self._get_broker_key(device.mqtt_broker_host, device.mqtt_broker_port or 1883)
+            topic_filter = self._subscription_filter(topic)
+            broker_key = self._device_broker_key(device)
             
             # Check if already subscribed to avoid duplicate subscriptions
-            if topic in self.subscribed_topics[broker_key]:
+            if topic_filter in self.subscribed_topics[broker_key]:
                 logger.debug(f"Device {device.id} already subscribed to topic {topic}, updating mapping")
                 # Update device mapping in case device ID changed
                 self.device_topic_map[topic] = device.id
                 return
             
-            # Subscribe to topic (support wildcards)
-            result = None
-            if topic.endswith('+'):
-                # Wildcard subscription
-                result = client.subscribe(topic)
-            else:
-                # Exact topic subscription
-                result = client.subscribe(topic)
+            # Subscribe to topic (wildcards are passed through to the broker)
+            result = client.subscribe(topic_filter)
             
             # Check subscription result
             if result and result[0] == mqtt.MQTT_ERR_SUCCESS:
-                self.subscribed_topics[broker_key].add(topic)
+                self.subscribed_topics[broker_key].add(topic_filter)
                 self.device_topic_map[topic] = device.id
                 logger.info(f"✓ Successfully subscribed to topic '{topic}' for device {device.id} ({device.name}) - waiting for data...")
             else:
@@ -264,47 +389,114 @@ class MQTTConnectionManager:
         except Exception as e:
             logger.error(f"Failed to subscribe device {device.id} ({device.name}) to MQTT: {e}", exc_info=True)
     
+    @_locked
     def unsubscribe_device(self, device: Device):
         """Unsubscribe from MQTT topic for a device."""
         if not device.mqtt_topic_pattern:
             return
         
         topic = device.mqtt_topic_pattern
-        broker_key = self._get_broker_key(device.mqtt_broker_host or '', device.mqtt_broker_port or 1883)
+        broker_key = self._device_broker_key(device)
         
         if broker_key in self.clients:
             client = self.clients[broker_key]
-            client.unsubscribe(topic)
-            self.subscribed_topics[broker_key].discard(topic)
+            topic_filter = self._subscription_filter(topic)
+            client.unsubscribe(topic_filter)
+            self.subscribed_topics[broker_key].discard(topic_filter)
             self.device_topic_map.pop(topic, None)
             logger.info(f"Unsubscribed from topic {topic} for device {device.id}")
     
+    @_locked
     def subscribe_all_devices(self):
-        """Subscribe to all active devices with MQTT configuration."""
+        """
+        Bring subscriptions in line with all active devices that have MQTT configuration.
+        Devices are grouped per broker connection (host, port, username): each group shares one
+        client, new topics go out in a single SUBSCRIBE and topics no device uses any more are
+        unsubscribed. Clients left without topics are disconnected.
+        Returns the broker keys that could not be connected or subscribed (empty when all succeeded).
+        """
         devices = Device.objects.filter(
             is_active=True,
             mqtt_broker_host__isnull=False
-        ).exclude(mqtt_broker_host='')
+        ).exclude(mqtt_broker_host='').exclude(mqtt_topic_pattern__isnull=True).exclude(mqtt_topic_pattern='')
         
-        device_list = list(devices)
-        count = len(device_list)
+        groups: Dict[str, List[Device]] = defaultdict(list)
+        for device in devices:
+            groups[self._device_broker_key(device)].append(device)
         
+        count = sum(len(group) for group in groups.values())
         if count == 0:
             logger.debug("No devices with MQTT configuration found to subscribe")
-            return
+        else:
+            logger.info(f"Subscribing to {count} device(s) on {len(groups)} broker connection(s)")
         
-        logger.info(f"Subscribing to {count} device(s) with MQTT configuration")
+        topic_map: Dict[str, int] = {}
+        failed: List[str] = []
+        for broker_key, group in groups.items():
+            first = group[0]
+            try:
+                client = self._get_client(
+                    host=first.mqtt_broker_host,
+                    port=first.mqtt_broker_port or 1883,
+                    username=first.mqtt_username or None,
+                    password=first.mqtt_password or None,
+                    use_tls=first.mqtt_use_tls,
+                    tls_ca_certs=first.mqtt_tls_ca_certs or None
+                )
+            except Exception as e:
+                logger.error(f"Failed to connect to {broker_key} for {len(group)} device(s): {e}", exc_info=True)
+                failed.append(broker_key)
+                continue
+            
+            wanted = {}
+            for device in group:
+                wanted.setdefault(device.mqtt_topic_pattern, device.id)
+            topic_map.update(wanted)
+            subscribed = self.subscribed_topics[broker_key]
+            filters = {self._subscription_filter(topic) for topic in wanted}
+            
+            new_topics = sorted(filters - subscribed)
+            if new_topics:
+                result = client.subscribe([(topic, 0) for topic in new_topics])
+                if result and result[0] == mqtt.MQTT_ERR_SUCCESS:
+                    subscribed.update(new_topics)
+                    logger.info(f"✓ Subscribed to {len(new_topics)} topic(s) on {broker_key}: {', '.join(new_topics[:5])}")
+                elif result and result[0] == mqtt.MQTT_ERR_NO_CONN:
+                    # Still connecting: on_connect subscribes everything recorded for this broker
+                    subscribed.update(new_topics)
+                    logger.info(f"{broker_key} not connected yet; {len(new_topics)} topic(s) will be subscribed on connect")
+                else:
+                    logger.error(f"Failed to subscribe to {len(new_topics)} topic(s) on {broker_key}: MQTT error {result}")
+                    failed.append(broker_key)
+            
+            stale_topics = sorted(subscribed - filters)
+            if stale_topics:
+                client.unsubscribe(stale_topics)
+                subscribed.difference_update(stale_topics)
+                logger.info(f"Unsubscribed from {len(stale_topics)} unused topic(s) on {broker_key}")
         
-        for device in device_list:
-            self.subscribe_device(device)
+        # Connections no active device uses any more
+        for broker_key in [key for key in self.clients if key not in groups]:
+            client = self.clients.pop(broker_key)
+            self.subscribed_topics.pop(broker_key, None)
+            try:
+                self._network.remove(client)
+                client.disconnect()
+                logger.info(f"Disconnected from broker {broker_key} (no devices left)")
+            except Exception as e:
+                logger.error(f"Error disconnecting from broker {broker_key}: {e}")
         
-        logger.info(f"✓ Completed subscription check for {count} device(s)")
+        self.device_topic_map = topic_map
+        if count:
+            logger.info(f"✓ Completed subscription check for {count} device(s)")
+        return failed
     
+    @_locked
     def disconnect_all(self):
         """Disconnect all MQTT clients."""
         for broker_key, client in self.clients.items():
             try:
-                client.loop_stop()
+                self._network.remove(client)
                 client.disconnect()
                 logger.info(f"Disconnected from broker {broker_key}")
             except Exception as e:
@@ -325,3 +517,20 @@ def get_mqtt_connection_manager() -> MQTTConnectionManager:
     if _connection_manager is None:
         _connection_manager = MQTTConnectionManager()
     return _connection_manager
+
+
+# One worker so subscriptions from saves are applied in order, off the request thread
+_subscribe_executor: Optional[ThreadPoolExecutor] = None
+_subscribe_executor_lock = threading.Lock()
+
+
+def subscribe_device_on_commit(device: Device) -> None:
+    """Subscribe a device in the background once the current transaction commits (broker connect can take CONNECT_WAIT_SECONDS)."""
+    def submit():
+        global _subscribe_executor
+        with _subscribe_executor_lock:
+            if _subscribe_executor is None:
+                _subscribe_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mqtt-subscribe')
+            executor = _subscribe_executor
+        executor.submit(get_mqtt_connection_manager().subscribe_device, device)
+    transaction.on_commit(submit)
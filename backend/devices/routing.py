@@ -0,0 +1,252 @@
+"""
+In-process topic -> device lookup for MQTT ingest (run_mqtt_subscriber and MQTTConnectionManager).
+Active devices are loaded once and matched from dicts, so routing a message costs no queries;
+each topic's result is remembered until the table is reloaded.
+The Device post_save/post_delete signals drop the table, but only in the process that saved the
+device. run_mqtt_subscriber and the web server are separate processes, so the table also runs a
+cheap change check (active device count and latest updated_at) every CHANGE_CHECK_SECONDS, and a
+topic that resolves to nothing or only to the single-active-device fallback re-checks first, so
+a device added elsewhere is not misattributed. MQTT_DEVICE_ROUTER_TTL forces a full reload for
+edits the check cannot see (queryset .update() calls that leave updated_at and is_active alone);
+0 turns that forced reload off, but not the change check.
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from django.db.models import Count, Max, Q
+
+from .models import Device
+from .services import INGEST_DEVICE_FIELDS
+
+# Bound on remembered topic results (wildcard subscriptions can deliver arbitrary topics)
+RESOLVED_TOPICS_MAX = 10000
+# Unmatched / fallback-matched topics are logged at most once per topic in this many seconds
+TOPIC_WARNING_INTERVAL = 60
+# Seconds between change checks against the devices table; a miss or fallback match may check
+# early, but at most once per MISS_CHECK_SECONDS
+CHANGE_CHECK_SECONDS = 5
+MISS_CHECK_SECONDS = 1
+
+
+class TopicTrie:
+    """
+    MQTT topic filters split on '/', with '+' (one level) and '#' (remaining levels) children.
+    A lookup walks the topic's levels once, preferring exact levels over '+' over '#'.
+    """
+    __slots__ = ('children', 'plus', 'hash', 'value')
+
+    def __init__(self):
+        self.children = {}
+        self.plus = None
+        self.hash = None
+        self.value = None
+
+    def insert(self, topic_filter, value):
+        """Add a filter; the first value inserted for a filter wins."""
+        node = self
+        for level in topic_filter.split('/'):
+            if level == '#':
+                if node.hash is None:
+                    node.hash = value
+                return
+            if level == '+':
+                if node.plus is None:
+                    node.plus = TopicTrie()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, TopicTrie())
+        if node.value is None:
+            node.value = value
+
+    def match(self, topic):
+        return self._match(topic.split('/'), 0)
+
+    def _match(self, levels, i):
+        if i == len(levels):
+            # "a/#" also matches "a"
+            return self.value if self.value is not None else self.hash
+        child = self.children.get(levels[i])
+        if child is not None:
+            found = child._match(levels, i + 1)
+            if found is not None:
+                return found
+        if self.plus is not None:
+            found = self.plus._match(levels, i + 1)
+            if found is not None:
+                return found
+        return self.hash
+
+
+class DeviceRouter:
+    """Active devices indexed by MQTT topic pattern and hardware address."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._checked_at = 0.0
+        self._fingerprint = None
+        self.devices = []
+        self.by_topic = {}
+        self.by_hw = {}
+        self.first_with_pattern = None
+        self.topic_filters = TopicTrie()
+        self._hw_pattern = None
+        self._resolved = {}
+        self._description = None
+        self._warned_at = {}
+
+    def invalidate(self):
+        """Force a reload on the next lookup."""
+        self._loaded_at = None
+
+    def _ensure_loaded(self, check_after=CHANGE_CHECK_SECONDS):
+        """Load the table if needed; returns True when it was (re)loaded."""
+        ttl = getattr(settings, 'MQTT_DEVICE_ROUTER_TTL', 60)
+        loaded_at = self._loaded_at
+        now = time.monotonic()
+        # ttl <= 0 only turns off the forced reload; the change check still runs
+        if loaded_at is not None and (ttl <= 0 or now - loaded_at < ttl):
+            if now - self._checked_at < check_after:
+                return False
+            with self._lock:
+                if self._loaded_at is not loaded_at or now - self._checked_at < check_after:
+                    return False  # another thread reloaded or checked while we waited
+                self._checked_at = now
+                if self._current_fingerprint() == self._fingerprint:
+                    return False
+                self._load()
+                return True
+        with self._lock:
+            if self._loaded_at is not None and self._loaded_at is not loaded_at:
+                return False  # another thread reloaded while we waited
+            self._load()
+            return True
+
+    @staticmethod
+    def _current_fingerprint():
+        # Changes with every save (auto_now) and every (de)activation or delete of an active device
+        return Device.objects.aggregate(
+            active=Count('pk', filter=Q(is_active=True)), updated=Max('updated_at')
+        )
+
+    def _load(self):
+        fingerprint = self._current_fingerprint()
+        # Default ordering (-created_at) so "first match" is the same device .first() returned
+        devices = list(Device.objects.filter(is_active=True).only(*INGEST_DEVICE_FIELDS))
+        by_topic, by_hw, topic_filters = {}, {}, TopicTrie()
+        for d in devices:
+            pattern = d.mqtt_topic_pattern
+            if pattern:
+                by_topic.setdefault(pattern, d)
+                if '+' in pattern or '#' in pattern:
+                    topic_filters.insert(pattern, d)
+            by_hw.setdefault(d.hardware_address, d)
+        self.devices = devices
+        self.by_topic = by_topic
+        self.by_hw = by_hw
+        self.topic_filters = topic_filters
+        self.first_with_pattern = next((d for d in devices if d.mqtt_topic_pattern), None)
+        # One compiled alternation for the partial match; longest address first so the most specific wins
+        addresses = sorted(by_hw, key=len, reverse=True)
+        self._hw_pattern = re.compile('|'.join(map(re.escape, addresses))) if addresses else None
+        self._resolved = {}
+        self._description = None
+        self._fingerprint = fingerprint
+        self._checked_at = self._loaded_at = time.monotonic()
+
+    def match(self, topic, topic_prefix=None):
+        """
+        Resolve a topic to (device, how), in the subscriber's precedence: exact topic
+        pattern, hardware address from the topic suffix, partial hardware address match,
+        then the only active device. Returns (None, None) when nothing matches.
+        """
+        return self._memoized((topic, bool(topic_prefix)), self._resolve, topic, topic_prefix)
+
+    def match_subscription(self, topic):
+        """
+        Resolve a topic delivered to MQTTConnectionManager (per-device broker subscriptions):
+        exact topic pattern, then the most specific wildcard pattern ('+' / '#', MQTT rules),
+        then the only active device. Returns (device, how) or (None, None).
+        """
+        return self._memoized((topic, 'subscription'), self._resolve_subscription, topic)
+
+    def _memoized(self, key, resolve, *args):
+        self._ensure_loaded()
+        result = self._resolved.get(key)
+        if result is None:
+            if len(self._resolved) >= RESOLVED_TOPICS_MAX:
+                self._resolved = {}
+            result = self._resolved[key] = resolve(*args)
+        # A miss or fallback may be a device another process just added: check before trusting it
+        if result[1] in (None, 'only_active') and self._ensure_loaded(check_after=MISS_CHECK_SECONDS):
+            result = self._resolved[key] = resolve(*args)
+        return result
+
+    def describe(self):
+        """Active devices as 'name (HW: ..., Topic: ...)' for warnings; built once per table load."""
+        self._ensure_loaded()
+        if self._description is None:
+            self._description = ', '.join(
+                f'{d.name} (HW: {d.hardware_address}, Topic: {d.mqtt_topic_pattern or "Not set"})'
+                for d in self.devices
+            )
+        return self._description
+
+    def should_warn(self, topic):
+        """True at most once per topic every TOPIC_WARNING_INTERVAL seconds (keeps misrouted feeds from flooding the log)."""
+        now = time.monotonic()
+        last = self._warned_at.get(topic)
+        if last is not None and now - last < TOPIC_WARNING_INTERVAL:
+            return False
+        if len(self._warned_at) >= RESOLVED_TOPICS_MAX:
+            self._warned_at = {}
+        self._warned_at[topic] = now
+        return True
+
+    def _resolve_subscription(self, topic):
+        device = self.by_topic.get(topic)
+        if device:
+            return device, 'topic'
+        device = self.topic_filters.match(topic)
+        if device:
+            return device, 'wildcard'
+        if len(self.devices) == 1:
+            return self.devices[0], 'only_active'
+        return None, None
+
+    def _resolve(self, topic, topic_prefix):
+        device = self.by_topic.get(topic)
+        if device:
+            return device, 'topic'
+
+        parts = topic.split('/', 1)
+        if topic_prefix and len(parts) > 1:
+            potential_hw = parts[-1]
+            device = self.by_hw.get(potential_hw)
+            if device:
+                return device, 'hardware_address'
+            # Any configured pattern that loosely matches the topic
+            candidate = self.first_with_pattern
+            if candidate and (
+                candidate.mqtt_topic_pattern in topic
+                or topic.endswith(candidate.mqtt_topic_pattern.split('/')[-1])
+            ):
+                return candidate, 'pattern'
+
+        hardware_address = parts[-1] if topic_prefix and len(parts) > 1 else topic
+        device = self.by_hw.get(hardware_address)
+        if device:
+            return device, 'hardware_address'
+        if len(hardware_address) >= 3 and self._hw_pattern is not None:
+            found = self._hw_pattern.search(hardware_address)
+            if found:
+                return self.by_hw[found.group()], 'partial'
+        if len(self.devices) == 1:
+            return self.devices[0], 'only_active'
+        return None, None
+
+
+device_router = DeviceRouter()
@@ -2,6 +2,22 @@ from rest_framework import serializers
 from .models import Device, ParameterMapping
 from accounts.serializers import UserListSerializer
 
+# Optional CharFields that DeviceSerializer.update stores as NULL when sent as ''
+OPTIONAL_CHAR_FIELDS = frozenset({
+    'area', 'building', 'floor', 'description',
+    'mqtt_broker_host', 'mqtt_topic_pattern', 'mqtt_topic_prefix', 'mqtt_username',
+})
+
+
+def clean_hardware_address(value):
+    """Shared hardware address check for device create/update and MQTT registration (free-form, max 255)."""
+    raw = str(value).strip() if value else ''
+    if not raw:
+        raise serializers.ValidationError('Hardware address is required.')
+    if len(raw) > 255:
+        raise serializers.ValidationError('Hardware address must be 255 characters or fewer.')
+    return raw
+
 
 class ParameterMappingSerializer(serializers.ModelSerializer):
     """Serializer for Parameter Mapping"""
@@ -13,21 +29,24 @@ class ParameterMappingSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
+        # Uniqueness is left to the DB constraint (the views handle IntegrityError)
+        extra_kwargs = {'hardware_key': {'validators': []}}
 
     def validate_hardware_key(self, value):
-        if not value or not str(value).strip():
+        key = str(value).strip() if value else ''
+        if not key:
             raise serializers.ValidationError('Hardware key is required (e.g. v, a, pf).')
-        key = str(value).strip()
         if len(key) > 50:
             raise serializers.ValidationError('Hardware key must be 50 characters or fewer.')
         return key
 
     def validate_ui_label(self, value):
-        if not value or not str(value).strip():
+        label = str(value).strip() if value else ''
+        if not label:
             raise serializers.ValidationError('Display label is required (e.g. Voltage, Current).')
-        if len(value.strip()) > 100:
+        if len(label) > 100:
             raise serializers.ValidationError('Display label must be 100 characters or fewer.')
-        return value.strip()
+        return label
 
 
 class DeviceSerializer(serializers.ModelSerializer):
@@ -46,11 +65,14 @@ class DeviceSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'last_data_received'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'last_data_received']
+        # Uniqueness is left to the DB constraint (the views handle IntegrityError)
+        extra_kwargs = {'hardware_address': {'validators': []}}
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
+        # Reuse the nested users just serialized instead of walking assigned_users a second time
         representation['assigned_user_ids'] = [
-            user.id for user in instance.assigned_users.all()
+            user['id'] for user in representation['assigned_users']
         ]
         return representation
 
@@ -74,42 +96,37 @@ class DeviceSerializer(serializers.ModelSerializer):
         assigned_user_ids = validated_data.pop('assigned_user_ids', None)
         
         # Handle empty strings for optional fields - convert to None
+        changed = []
         for attr, value in validated_data.items():
             # Convert empty strings to None for optional CharField fields
-            if value == '' and attr in ['area', 'building', 'floor', 'description', 
-                                       'mqtt_broker_host', 'mqtt_topic_pattern', 
-                                       'mqtt_topic_prefix', 'mqtt_username']:
-                setattr(instance, attr, None)
-            else:
+            if value == '' and attr in OPTIONAL_CHAR_FIELDS:
+                value = None
+            if getattr(instance, attr) != value:
                 setattr(instance, attr, value)
+                changed.append(attr)
         
-        instance.save()
+        # Write only the edited columns; devices.signals skips MQTT re-subscription unless MQTT fields are among them
+        if changed:
+            instance.save(update_fields=changed + ['updated_at'])
         if assigned_user_ids is not None:
             instance.assigned_users.set(assigned_user_ids)
         return instance
 
     def validate_hardware_address(self, value):
-        if not value or not str(value).strip():
-            raise serializers.ValidationError('Hardware address is required.')
-        raw = str(value).strip()
-        if len(raw) > 255:
-            raise serializers.ValidationError('Hardware address must be 255 characters or fewer.')
-        return raw
+        return clean_hardware_address(value)
 
     def validate_name(self, value):
-        if not value or not str(value).strip():
+        name = str(value).strip() if value else ''
+        if not name:
             raise serializers.ValidationError('Device name is required.')
-        if len(value.strip()) > 200:
+        if len(name) > 200:
             raise serializers.ValidationError('Device name must be 200 characters or fewer.')
-        return value.strip()
+        return name
 
 
 class DeviceListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for listing devices"""
-    assigned_users_count = serializers.IntegerField(
-        source='assigned_users.count',
-        read_only=True
-    )
+    assigned_users_count = serializers.SerializerMethodField(read_only=True)
     assigned_user_ids = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -124,8 +141,15 @@ class DeviceListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'last_data_received']
 
     def get_assigned_user_ids(self, obj):
+        # DeviceListView annotates the ids on PostgreSQL (NULL for a device with no users)
+        # and prefetches them elsewhere
+        if hasattr(obj, 'assigned_user_id_list'):
+            return obj.assigned_user_id_list or []
         return [u.id for u in obj.assigned_users.all()]
 
+    def get_assigned_users_count(self, obj):
+        return len(self.get_assigned_user_ids(obj))
+
 
 class MQTTConfigSerializer(serializers.Serializer):
     """Serializer for MQTT configuration"""
@@ -149,6 +173,8 @@ class MQTTTestSerializer(serializers.Serializer):
     mqtt_use_tls = serializers.BooleanField(default=False)
     mqtt_tls_ca_certs = serializers.CharField(required=False, allow_blank=True, allow_null=True)
     timeout_seconds = serializers.IntegerField(default=15, min_value=5, max_value=60)
+    # Return early once messages arrived and the broker was silent this long (0 = always wait timeout_seconds)
+    quiet_seconds = serializers.IntegerField(default=3, min_value=0, max_value=60)
     
     def validate_mqtt_broker_host(self, value):
         if not value or not value.strip():
@@ -181,28 +207,24 @@ class MQTTDeviceRegistrationSerializer(serializers.Serializer):
     )
     
     def validate_hardware_address(self, value):
-        if not value or not str(value).strip():
-            raise serializers.ValidationError('Hardware address is required.')
-        raw = str(value).strip()
-        if len(raw) > 255:
-            raise serializers.ValidationError('Hardware address must be 255 characters or fewer.')
-        return raw
+        return clean_hardware_address(value)
     
     def validate_name(self, value):
-        if not value or not str(value).strip():
+        name = str(value).strip() if value else ''
+        if not name:
             raise serializers.ValidationError('Device name is required.')
-        if len(value.strip()) > 200:
+        if len(name) > 200:
             raise serializers.ValidationError('Device name must be 200 characters or fewer.')
-        return value.strip()
+        return name
     
     def validate_field_mappings(self, value):
         """Validate that field mapping IDs exist"""
         if not value:
             return {}
-        from .models import ParameterMapping
-        mapping_ids = list(value.values())
-        existing_mappings = ParameterMapping.objects.filter(id__in=mapping_ids).values_list('id', flat=True)
-        missing_ids = set(mapping_ids) - set(existing_mappings)
+        mapping_ids = set(value.values())  # several fields may map to the same id; query each once
+        missing_ids = mapping_ids.difference(
+            ParameterMapping.objects.filter(id__in=mapping_ids).values_list('id', flat=True)
+        )
         if missing_ids:
             raise serializers.ValidationError(f'Parameter mapping IDs not found: {list(missing_ids)}')
         return value
@@ -1,26 +1,64 @@
 """
 Module 5: Threshold breach check and alarm creation.
 Called after device data is stored (POST device-data or MQTT subscriber).
+Also holds the buffered DeviceData writer used by the MQTT subscriber.
 """
-import json
+import atexit
 import logging
+import math
+import operator
+import queue
+import ssl
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from functools import reduce
 from typing import Dict, List, Optional
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, Q, Value, When
 from django.utils import timezone
 
+import orjson
 import paho.mqtt.client as mqtt
 
-from .models import Device, Threshold, Alarm, ParameterMapping
+from .models import Device, DeviceData, Threshold, Alarm, ParameterMapping
 
 logger = logging.getLogger(__name__)
 
 
+_parameter_labels: Optional[Dict[str, str]] = None  # hardware_key -> ui_label
+_parameter_labels_loaded_at = 0.0
+_parameter_labels_lock = threading.Lock()
+
+
+def invalidate_parameter_labels() -> None:
+    """Drop the cached hardware_key -> ui_label table (ParameterMapping post_save/post_delete)."""
+    global _parameter_labels
+    _parameter_labels = None
+
+
+def _get_parameter_labels() -> Dict[str, str]:
+    global _parameter_labels, _parameter_labels_loaded_at
+    labels = _parameter_labels
+    ttl = getattr(settings, 'PARAMETER_LABEL_CACHE_TTL', 60)
+    if labels is not None and (ttl <= 0 or time.monotonic() - _parameter_labels_loaded_at < ttl):
+        return labels
+    with _parameter_labels_lock:
+        if _parameter_labels is None or _parameter_labels is labels:
+            _parameter_labels = dict(ParameterMapping.objects.values_list('hardware_key', 'ui_label'))
+            _parameter_labels_loaded_at = time.monotonic()
+        return _parameter_labels
+
+
 def get_parameter_label(parameter_key: str) -> str:
-    """Resolve hardware key to UI label from ParameterMapping."""
-    mapping = ParameterMapping.objects.filter(hardware_key=parameter_key).first()
-    return mapping.ui_label if mapping else parameter_key
+    """
+    Resolve hardware key to UI label from ParameterMapping. All mappings are loaded once per
+    process and reused for PARAMETER_LABEL_CACHE_TTL seconds (dropped at once on in-process edits).
+    """
+    return _get_parameter_labels().get(parameter_key, parameter_key)
 
 
 def check_thresholds_and_create_alarms(device: Device, parameters: dict) -> list:
@@ -32,11 +70,13 @@ def check_thresholds_and_create_alarms(device: Device, parameters: dict) -> list
     if not parameters or not isinstance(parameters, dict):
         return []
 
-    thresholds = Threshold.objects.filter(device=device)
-    created = []
-
-    for th in thresholds:
-        value = parameters.get(th.parameter_key)
+    # Collect breaches first; most readings breach nothing and then no alarm query is needed
+    breaches = []
+    # Plain tuples: only three columns are compared, no Threshold instances needed
+    for parameter_key, th_min, th_max in Threshold.objects.filter(device=device).values_list(
+        'parameter_key', 'min', 'max'
+    ):
+        value = parameters.get(parameter_key)
         if value is None:
             continue
         try:
@@ -44,75 +84,384 @@ def check_thresholds_and_create_alarms(device: Device, parameters: dict) -> list
         except (TypeError, ValueError):
             continue
 
-        label = get_parameter_label(th.parameter_key)
-
-        if th.min is not None and value < th.min:
-            if not Alarm.objects.filter(
-                device=device,
-                parameter_key=th.parameter_key,
-                acknowledged=False
-            ).exists():
-                alarm = Alarm.objects.create(
-                    device=device,
-                    parameter_key=th.parameter_key,
-                    parameter_label=label,
-                    value=value,
-                    threshold=th.min,
-                    type=Alarm.TYPE_MIN,
-                )
-                created.append(alarm)
-                _send_alarm_email(alarm)
-
-        if th.max is not None and value > th.max:
-            if not Alarm.objects.filter(
-                device=device,
-                parameter_key=th.parameter_key,
-                acknowledged=False
-            ).exists():
-                alarm = Alarm.objects.create(
-                    device=device,
-                    parameter_key=th.parameter_key,
-                    parameter_label=label,
-                    value=value,
-                    threshold=th.max,
-                    type=Alarm.TYPE_MAX,
-                )
-                created.append(alarm)
-                _send_alarm_email(alarm)
+        if th_min is not None and value < th_min:
+            breaches.append((parameter_key, value, th_min, Alarm.TYPE_MIN))
+        if th_max is not None and value > th_max:
+            breaches.append((parameter_key, value, th_max, Alarm.TYPE_MAX))
+
+    if not breaches:
+        return []
+
+    # One query for all keys that already have an unacknowledged alarm (replaces a per-threshold .exists())
+    open_alarms = set(Alarm.objects.filter(
+        device=device,
+        parameter_key__in={key for key, _, _, _ in breaches},
+        acknowledged=False
+    ).values_list('parameter_key', flat=True))
 
+    created = []
+    for key, value, limit, alarm_type in breaches:
+        if key in open_alarms:
+            continue
+        created.append(Alarm(
+            device=device,
+            parameter_key=key,
+            parameter_label=get_parameter_label(key),
+            value=value,
+            threshold=limit,
+            type=alarm_type,
+        ))
+        open_alarms.add(key)
+
+    if created:
+        # Single INSERT for all breaches of this reading; emails go out off this thread
+        Alarm.objects.bulk_create(created)
+        _send_alarm_emails_async(created)
     return created
 
 
-def _send_alarm_email(alarm: Alarm) -> None:
-    """Send email notification if ALARM_EMAIL_TO is configured."""
+# Columns the ingest paths (POST device-data, MQTT) read from Device; loading only these skips
+# the TextFields (description, mqtt_tls_ca_certs) and broker credentials on every lookup.
+INGEST_DEVICE_FIELDS = ('id', 'name', 'hardware_address', 'mqtt_topic_pattern', 'is_active')
+
+
+def numeric_parameters(data: dict) -> dict:
+    """
+    Keep the numeric values of a decoded MQTT payload: numbers as-is, numeric strings as float.
+    Non-finite strings ("nan", "inf") are dropped along with anything float() rejects.
+    """
+    parameters = {}
+    for k, v in data.items():
+        if isinstance(v, (int, float)):
+            parameters[str(k)] = v
+        elif isinstance(v, str):
+            try:
+                number = float(v)
+            except ValueError:
+                continue
+            if math.isfinite(number):
+                parameters[str(k)] = number
+    return parameters
+
+
+# Cache counter bumped after every committed DeviceData write (MQTT writer batch, POST ingest,
+# retention cleanup). Polled endpoints put it in their ETag: Max(timestamp) alone misses rows
+# that commit late with a timestamp older than the newest reading.
+DEVICE_DATA_VERSION_KEY = 'device_data:version'
+
+
+def get_device_data_version() -> int:
+    # Seeded from the clock, so an evicted counter does not restart at a value already handed out
+    return cache.get_or_set(DEVICE_DATA_VERSION_KEY, lambda: time.time_ns() // 1000, timeout=None)
+
+
+def bump_device_data_version() -> None:
+    try:
+        cache.incr(DEVICE_DATA_VERSION_KEY)
+    except ValueError:  # not set yet or evicted
+        cache.add(DEVICE_DATA_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+
+
+def record_last_data_received(device: Device, timestamp) -> None:
+    """
+    Set device.last_data_received with a plain UPDATE (no save(), so no post_save MQTT re-subscribe),
+    written at most once per LAST_DATA_RECEIVED_INTERVAL seconds per device and never moved
+    backwards; the in-memory instance is always updated.
+    """
+    device.last_data_received = timestamp
+    interval = getattr(settings, 'LAST_DATA_RECEIVED_INTERVAL', 0)
+    # cache.add only succeeds when the key is absent, i.e. no write for this device in the interval
+    if interval > 0 and not cache.add(f'device:last_data:{device.pk}', 1, timeout=interval):
+        return
+    Device.objects.filter(_older_than(device.pk, timestamp)).update(last_data_received=timestamp)
+
+
+def _older_than(device_id: int, timestamp) -> Q:
+    """
+    Row filter for "device's last_data_received is unset or before timestamp". Used in the UPDATE's
+    WHERE clause so concurrent writers never move it backwards and no-op rows are not rewritten.
+    """
+    return Q(pk=device_id) & (Q(last_data_received__isnull=True) | Q(last_data_received__lt=timestamp))
+
+
+_threshold_executor = None
+_threshold_executor_lock = threading.Lock()
+_threshold_pending = 0  # checks submitted and not finished yet, guarded by _threshold_executor_lock
+
+
+def _get_threshold_executor() -> ThreadPoolExecutor:
+    global _threshold_executor
+    with _threshold_executor_lock:
+        if _threshold_executor is None:
+            _threshold_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='threshold-check')
+        return _threshold_executor
+
+
+def _run_threshold_check(device: Device, parameters: dict) -> None:
+    global _threshold_pending
+    try:
+        check_thresholds_and_create_alarms(device, parameters)
+    except Exception as e:
+        logger.error(f'Threshold check failed for device {device.id}: {e}', exc_info=True)
+    finally:
+        with _threshold_executor_lock:
+            _threshold_pending -= 1
+            idle = _threshold_pending == 0
+        # Worker thread has its own DB connection; reuse it while checks are queued, close it when idle
+        if idle:
+            connection.close()
+
+
+def _submit_threshold_check(device: Device, parameters: dict) -> None:
+    global _threshold_pending
+    executor = _get_threshold_executor()
+    with _threshold_executor_lock:
+        if _threshold_pending >= getattr(settings, 'THRESHOLD_CHECK_QUEUE_SIZE', 10000):
+            logger.warning(f'Threshold check queue full; skipping check for device {device.id}')
+            return
+        _threshold_pending += 1
+    executor.submit(_run_threshold_check, device, parameters)
+
+
+def check_thresholds_async(device: Device, parameters: dict) -> None:
+    """
+    Queue check_thresholds_and_create_alarms on a single background worker once the current
+    transaction commits, so the caller (ingest request, MQTT callback) returns right after
+    storing the reading. At most THRESHOLD_CHECK_QUEUE_SIZE checks wait; further ones are skipped
+    with a warning. Runs inline when THRESHOLD_CHECK_ASYNC is False.
+    """
+    if not parameters or not isinstance(parameters, dict):
+        return
+    if not getattr(settings, 'THRESHOLD_CHECK_ASYNC', True):
+        check_thresholds_and_create_alarms(device, parameters)
+        return
+    transaction.on_commit(lambda: _submit_threshold_check(device, parameters))
+
+
+class DeviceDataWriter:
+    """
+    Buffers MQTT readings and stores them with one bulk_create per batch, plus one UPDATE of
+    last_data_received for every device in the batch. A batch is flushed when it reaches
+    MQTT_PERSIST_BATCH_SIZE rows or MQTT_PERSIST_FLUSH_SECONDS after its first reading.
+    With MQTT_SKIP_UNCHANGED_SECONDS > 0, a reading identical to the device's last stored one is
+    skipped unless that one is older than the window (so steady devices still write a heartbeat).
+    MQTT_PERSIST_ASYNC_COMMIT commits batches with synchronous_commit=off on PostgreSQL.
+    A failed batch is retried without readings for deleted devices, then one reading at a time.
+    """
+
+    def __init__(self):
+        self.batch_size = max(1, getattr(settings, 'MQTT_PERSIST_BATCH_SIZE', 500))
+        self.flush_seconds = getattr(settings, 'MQTT_PERSIST_FLUSH_SECONDS', 1.0)
+        self._queue = queue.Queue(maxsize=getattr(settings, 'MQTT_PERSIST_QUEUE_SIZE', 10000))
+        self.skip_unchanged_seconds = getattr(settings, 'MQTT_SKIP_UNCHANGED_SECONDS', 0)
+        self.async_commit = getattr(settings, 'MQTT_PERSIST_ASYNC_COMMIT', False)
+        self._last_stored: Dict[int, tuple] = {}  # device_id -> (parameters, monotonic time stored)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='device-data-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def add(self, device: Device, parameters: dict, timestamp=None) -> bool:
+        """
+        Queue one reading; stored synchronously if the buffer is full so nothing is dropped.
+        Returns False when the reading was skipped as unchanged (see MQTT_SKIP_UNCHANGED_SECONDS).
+        """
+        if self.skip_unchanged_seconds > 0:
+            now = time.monotonic()
+            last = self._last_stored.get(device.pk)
+            if last is not None and last[0] == parameters and now - last[1] < self.skip_unchanged_seconds:
+                return False
+            self._last_stored[device.pk] = (parameters, now)
+        timestamp = timestamp or timezone.now()
+        device.last_data_received = timestamp
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((device.pk, parameters, timestamp))
+        except queue.Full:
+            logger.warning(f'DeviceData buffer full; storing reading for device {device.pk} synchronously')
+            self._write([(device.pk, parameters, timestamp)])
+        return True
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch: list) -> None:
+        try:
+            try:
+                self._store(batch)
+                return
+            except Exception as e:
+                logger.warning(f'Failed to store {len(batch)} MQTT reading(s), retrying without bad rows: {e}')
+            # Usually a device deleted while its readings were buffered (FK violation): drop its rows
+            # and retry the rest as one batch, then one transaction per reading
+            try:
+                existing = set(Device.objects.filter(pk__in={d for d, _, _ in batch}).values_list('pk', flat=True))
+            except Exception as e:
+                logger.error(f'Failed to store {len(batch)} MQTT reading(s): {e}', exc_info=True)
+                return
+            kept = [row for row in batch if row[0] in existing]
+            if len(kept) < len(batch):
+                logger.warning(f'Dropped {len(batch) - len(kept)} MQTT reading(s) for deleted devices')
+                try:
+                    self._store(kept)
+                    return
+                except Exception:
+                    pass
+            failed = 0
+            for row in kept:
+                try:
+                    self._store([row])
+                except Exception as e:
+                    failed += 1
+                    logger.error(f'Failed to store MQTT reading for device {row[0]}: {e}', exc_info=failed == 1)
+            if failed:
+                logger.error(f'Stored {len(kept) - failed} of {len(kept)} MQTT reading(s) one by one')
+        finally:
+            if threading.current_thread() is self._thread:
+                connection.close()
+
+    def _store(self, batch: list) -> None:
+        if not batch:
+            return
+        latest = {}
+        for device_id, _, timestamp in batch:
+            if device_id not in latest or timestamp > latest[device_id]:
+                latest[device_id] = timestamp
+        with transaction.atomic():
+            if self.async_commit and connection.vendor == 'postgresql':
+                # Commit without waiting for the WAL flush; applies to this batch's transaction only
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL synchronous_commit = off')
+            # ignore_conflicts drops the RETURNING id clause (ids are never read here); DeviceData
+            # has no unique constraint besides its serial id, so no reading is skipped
+            DeviceData.objects.bulk_create(
+                [DeviceData(device_id=d, parameters=p, timestamp=t) for d, p, t in batch],
+                batch_size=self.batch_size,
+                ignore_conflicts=True,
+            )
+            Device.objects.filter(
+                reduce(operator.or_, (_older_than(pk, ts) for pk, ts in latest.items()))
+            ).update(
+                last_data_received=Case(*[When(pk=pk, then=Value(ts)) for pk, ts in latest.items()])
+            )
+        bump_device_data_version()
+        logger.debug(f'Stored {len(batch)} reading(s) for {len(latest)} device(s)')
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush whatever is buffered and stop the writer thread."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning('DeviceData buffer still full at shutdown; some readings may not be stored')
+            return
+        thread.join(timeout)
+
+
+_device_data_writer = None
+_device_data_writer_lock = threading.Lock()
+
+
+def get_device_data_writer() -> DeviceDataWriter:
+    global _device_data_writer
+    with _device_data_writer_lock:
+        if _device_data_writer is None:
+            _device_data_writer = DeviceDataWriter()
+        return _device_data_writer
+
+
+def _alarm_email_recipients() -> list:
     recipients = getattr(settings, 'ALARM_EMAIL_TO', None)
     if not recipients:
-        return
+        return []
     if isinstance(recipients, str):
         recipients = [r.strip() for r in recipients.split(',') if r.strip()]
-    if not recipients:
+    return recipients
+
+
+_alarm_email_executor = None
+_alarm_email_executor_lock = threading.Lock()
+
+
+def _send_alarm_emails_async(alarms: List[Alarm]) -> None:
+    """Hand alarm emails to a small background pool so SMTP latency never stalls threshold checks."""
+    global _alarm_email_executor
+    if not _alarm_email_recipients():
+        return
+    with _alarm_email_executor_lock:
+        if _alarm_email_executor is None:
+            _alarm_email_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='alarm-email')
+        executor = _alarm_email_executor
+    executor.submit(_send_alarm_emails, alarms)
+
+
+def _send_alarm_emails(alarms: List[Alarm]) -> None:
+    """Send one email per alarm if ALARM_EMAIL_TO is configured, over a single SMTP connection."""
+    recipients = _alarm_email_recipients()
+    if not recipients or not alarms:
         return
 
     try:
-        from django.core.mail import send_mail
-        subject = f"Threshold breach: {alarm.device.name} - {alarm.parameter_label}"
-        message = (
-            f"Device: {alarm.device.name}\n"
-            f"Parameter: {alarm.parameter_label} ({alarm.parameter_key})\n"
-            f"Value: {alarm.value}\n"
-            f"Limit ({alarm.type}): {alarm.threshold}\n"
-        )
-        send_mail(
-            subject,
-            message,
-            from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None) or 'noreply@localhost',
-            recipient_list=recipients,
-            fail_silently=True,
-        )
+        from django.core.mail import EmailMessage, get_connection
+        from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', None) or 'noreply@localhost'
+        messages = []
+        for alarm in alarms:
+            subject = f"Threshold breach: {alarm.device.name} - {alarm.parameter_label}"
+            message = (
+                f"Device: {alarm.device.name}\n"
+                f"Parameter: {alarm.parameter_label} ({alarm.parameter_key})\n"
+                f"Value: {alarm.value}\n"
+                f"Limit ({alarm.type}): {alarm.threshold}\n"
+            )
+            messages.append(EmailMessage(subject, message, from_email, recipients))
+        # One connect/login (and TLS handshake) for the whole batch
+        get_connection(fail_silently=True).send_messages(messages)
     except Exception as e:
         logger.warning('Failed to send alarm email: %s', e)
 
 
+def configure_mqtt_tls(client: mqtt.Client, tls_ca_certs: Optional[str] = None) -> None:
+    """
+    Enable TLS on a paho client. tls_ca_certs is either a CA file path or PEM content (as stored in
+    Device.mqtt_tls_ca_certs); PEM content is loaded straight into the SSL context, so no temp file
+    is written and the PEM text is never stat()ed as a path. Empty means the system CA store.
+    """
+    if not tls_ca_certs:
+        client.tls_set()
+    elif '-----BEGIN' in tls_ca_certs or '\n' in tls_ca_certs:
+        client.tls_set_context(ssl.create_default_context(cadata=tls_ca_certs))
+    else:
+        client.tls_set(ca_certs=tls_ca_certs)
+
+
 def test_mqtt_connection(
     broker_host: str,
     broker_port: int,
@@ -121,7 +470,8 @@ def test_mqtt_connection(
     password: Optional[str] = None,
     use_tls: bool = False,
     tls_ca_certs: Optional[str] = None,
-    timeout_seconds: int = 15
+    timeout_seconds: int = 15,
+    quiet_seconds: int = 0
 ) -> Dict:
     """
     Test MQTT connection and capture sample messages.
@@ -135,6 +485,7 @@ def test_mqtt_connection(
         use_tls: Whether to use TLS/SSL
         tls_ca_certs: Optional CA certificate path or content
         timeout_seconds: How long to listen for messages (default: 15)
+        quiet_seconds: Stop early once messages were seen and none arrived for this long (0 = listen the full timeout)
     
     Returns:
         Dict with:
@@ -146,13 +497,17 @@ def test_mqtt_connection(
             - error: Optional error message
     """
     messages = []
+    # Collected as messages arrive so the result needs no second pass over them
+    detected_hardware_addresses = set()
+    all_parameter_keys = set()
     connection_status = "disconnected"
     error_message = None
-    connection_event = threading.Event()
-    messages_lock = threading.Lock()
+    connack_received = False
+    last_message_at = None
+    # All callbacks run in this thread: the network loop is driven below with client.loop()
     
     def on_connect(client, userdata, flags, reason_code, properties=None):
-        nonlocal connection_status
+        nonlocal connection_status, error_message, connack_received
         rc = getattr(reason_code, 'value', reason_code) if reason_code is not None else 0
         if rc == 0:
             connection_status = "connected"
@@ -163,56 +518,50 @@ def test_mqtt_connection(
         else:
             connection_status = f"failed (code: {rc})"
             error_message = f"MQTT connection failed with code: {rc}"
-        connection_event.set()
+        connack_received = True
     
     def on_message(client, userdata, msg):
+        nonlocal last_message_at
+        last_message_at = time.monotonic()
         try:
             topic = msg.topic
-            raw_payload = msg.payload.decode('utf-8')
             
-            # Parse JSON payload
+            # Parse JSON payload (orjson reads the bytes directly; the raw text is decoded after capture)
             try:
-                parsed_payload = json.loads(raw_payload)
+                parsed_payload = orjson.loads(msg.payload)
                 if not isinstance(parsed_payload, dict):
                     logger.warning(f"Non-dict payload on {topic}: {parsed_payload}")
                     return
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 logger.warning(f"Invalid JSON on {topic}: {e}")
                 parsed_payload = {}
             
             # Extract hardware address from topic (last segment) or payload (identification only)
-            hardware_address = None
-            if topic:
-                parts = topic.split('/')
-                if parts:
-                    potential_hw = parts[-1]
-                    if potential_hw:
-                        hardware_address = potential_hw
+            # rpartition finds the last segment without building a list of every level
+            hardware_address = topic.rpartition('/')[2] if topic else None
             
             # Also check payload for hardware_address field
             if not hardware_address and isinstance(parsed_payload, dict):
                 hw_from_payload = parsed_payload.get('hardware_address') or parsed_payload.get('hw_addr')
-                if hw_from_payload and str(hw_from_payload).strip():
-                    hardware_address = str(hw_from_payload).strip()
+                if hw_from_payload:
+                    hardware_address = str(hw_from_payload).strip() or None
             
-            # Extract parameter keys (numeric values only)
-            parameter_keys = []
-            if isinstance(parsed_payload, dict):
-                for k, v in parsed_payload.items():
-                    if isinstance(v, (int, float)) or (isinstance(v, str) and v.replace('.', '', 1).replace('-', '', 1).isdigit()):
-                        parameter_keys.append(str(k))
+            # Extract parameter keys (numeric values only), by the same rule the ingest paths store them
+            parameter_keys = list(numeric_parameters(parsed_payload)) if isinstance(parsed_payload, dict) else []
             
             message_data = {
                 "topic": topic,
-                "raw_payload": raw_payload,
+                "raw_payload": msg.payload,
                 "parsed_payload": parsed_payload,
                 "hardware_address": hardware_address,
                 "parameter_keys": parameter_keys,
-                "timestamp": timezone.now().isoformat()
+                "timestamp": time.time()  # formatted once after capture ends
             }
             
-            with messages_lock:
-                messages.append(message_data)
+            messages.append(message_data)
+            if hardware_address:
+                detected_hardware_addresses.add(hardware_address)
+            all_parameter_keys.update(parameter_keys)
                 
         except Exception as e:
             logger.warning(f"Error processing message on {msg.topic}: {e}")
@@ -237,47 +586,22 @@ def test_mqtt_connection(
         
         # Configure TLS if needed
         if use_tls:
-            if tls_ca_certs:
-                # If tls_ca_certs is a file path, use it; otherwise treat as certificate content
-                import os
-                if os.path.exists(tls_ca_certs):
-                    client.tls_set(ca_certs=tls_ca_certs)
-                else:
-                    # Treat as certificate content, write to temp file
-                    import tempfile
-                    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.pem') as f:
-                        f.write(tls_ca_certs)
-                        temp_cert_path = f.name
-                    client.tls_set(ca_certs=temp_cert_path)
-                    # Clean up temp file after connection
-                    try:
-                        os.unlink(temp_cert_path)
-                    except:
-                        pass
-            else:
-                client.tls_set()
+            configure_mqtt_tls(client, tls_ca_certs)
         
         # Connect to broker
         client.connect(broker_host, broker_port, 60)
         
-        # Start network loop in background thread
-        client.loop_start()
+        # Run the network loop in this thread (no paho background thread) until CONNACK arrives
+        deadline = time.monotonic() + 10
+        while not connack_received and time.monotonic() < deadline:
+            if client.loop(timeout=0.5) != mqtt.MQTT_ERR_SUCCESS:
+                break
         
-        # Wait for connection (with timeout)
-        if not connection_event.wait(timeout=10):
-            client.loop_stop()
-            client.disconnect()
-            return {
-                "success": False,
-                "connection_status": "timeout",
-                "messages": [],
-                "detected_hardware_addresses": [],
-                "all_parameter_keys": [],
-                "error": "Connection timeout - broker did not respond within 10 seconds"
-            }
+        if not connack_received:
+            connection_status = "timeout"
+            error_message = "Connection timeout - broker did not respond within 10 seconds"
         
         if connection_status != "connected":
-            client.loop_stop()
             client.disconnect()
             return {
                 "success": False,
@@ -288,30 +612,29 @@ def test_mqtt_connection(
                 "error": error_message or f"Failed to connect: {connection_status}"
             }
         
-        # Listen for messages for the specified timeout
-        time.sleep(timeout_seconds)
+        # Listen for messages for the specified timeout, or until the broker goes quiet after sending some
+        deadline = time.monotonic() + timeout_seconds
+        while time.monotonic() < deadline:
+            if client.loop(timeout=min(0.5, max(deadline - time.monotonic(), 0))) != mqtt.MQTT_ERR_SUCCESS:
+                break  # connection lost; return what was captured
+            if quiet_seconds and last_message_at is not None and time.monotonic() - last_message_at >= quiet_seconds:
+                break
         
-        # Stop and disconnect
-        client.loop_stop()
+        # Disconnect
         client.disconnect()
         
-        # Extract unique hardware addresses and parameter keys
-        detected_hardware_addresses = list(set([
-            msg["hardware_address"] for msg in messages
-            if msg["hardware_address"]
-        ]))
-        
-        all_parameter_keys = list(set([
-            key for msg in messages
-            for key in msg["parameter_keys"]
-        ]))
+        # Same ISO format timezone.now().isoformat() gives (UTC), done here instead of per message
+        tz = dt_timezone.utc if settings.USE_TZ else None
+        for msg in messages:
+            msg["timestamp"] = datetime.fromtimestamp(msg["timestamp"], tz).isoformat()
+            msg["raw_payload"] = msg["raw_payload"].decode('utf-8', errors='replace')
         
         return {
             "success": True,
             "connection_status": connection_status,
             "messages": messages,
-            "detected_hardware_addresses": detected_hardware_addresses,
-            "all_parameter_keys": all_parameter_keys,
+            "detected_hardware_addresses": list(detected_hardware_addresses),
+            "all_parameter_keys": list(all_parameter_keys),
             "error": None
         }
         
@@ -2,16 +2,45 @@
 Django signals for device-related events.
 """
 import logging
-from django.db.models.signals import post_save, post_delete
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Device
+from .models import Device, ParameterMapping
+from .utils import visible_devices_cache_key
 
 logger = logging.getLogger(__name__)
 
 
+def _signal_resubscribe():
+    """
+    Wake the MQTT re-subscribe loop in DevicesConfig and drop the MQTT topic -> device table,
+    once the current transaction commits (before that, the reload would still read the old rows).
+    """
+    from .apps import DevicesConfig
+    from .routing import device_router
+
+    def signal():
+        DevicesConfig._resubscribe_event.set()
+        device_router.invalidate()
+    transaction.on_commit(signal)
+
+
+# Fields that affect MQTT subscriptions or topic routing; saves limited to other fields skip the MQTT work
+MQTT_DEVICE_FIELDS = frozenset({
+    'hardware_address', 'name', 'is_active',
+    'mqtt_broker_host', 'mqtt_broker_port', 'mqtt_topic_prefix', 'mqtt_topic_pattern',
+    'mqtt_username', 'mqtt_password', 'mqtt_use_tls', 'mqtt_tls_ca_certs',
+})
+
+
 @receiver(post_save, sender=Device)
-def device_saved(sender, instance, created, **kwargs):
+def device_saved(sender, instance, created, update_fields=None, **kwargs):
     """Automatically subscribe to MQTT when a device is created or updated with MQTT configuration."""
+    if update_fields is not None and MQTT_DEVICE_FIELDS.isdisjoint(update_fields):
+        logger.debug(f'Device {instance.id} saved without MQTT changes ({sorted(update_fields)}), skipping MQTT subscription')
+        return
+    _signal_resubscribe()
     # Only subscribe if device has complete MQTT configuration
     if not instance.mqtt_broker_host or not instance.mqtt_topic_pattern:
         logger.debug(f'Device {instance.id} missing MQTT config (host: {instance.mqtt_broker_host}, pattern: {instance.mqtt_topic_pattern})')
@@ -23,13 +52,12 @@ def device_saved(sender, instance, created, **kwargs):
         return
     
     try:
-        from .mqtt_service import get_mqtt_connection_manager
-        manager = get_mqtt_connection_manager()
+        from .mqtt_service import subscribe_device_on_commit
         
         # Always try to subscribe - subscribe_device will create clients if needed
-        # This ensures immediate subscription even if manager wasn't initialized yet
-        manager.subscribe_device(instance)
-        logger.info(f'✓ Automatically subscribed device {instance.id} ({instance.name}) to MQTT topic {instance.mqtt_topic_pattern} after {"creation" if created else "update"}')
+        # Runs after commit on a background worker so the save never waits on the broker
+        subscribe_device_on_commit(instance)
+        logger.info(f'✓ Scheduled MQTT subscription for device {instance.id} ({instance.name}) to topic {instance.mqtt_topic_pattern} after {"creation" if created else "update"}')
     except Exception as e:
         # Don't fail device save if MQTT subscription fails, but log it
         logger.warning(f'Failed to auto-subscribe device {instance.id} to MQTT (will retry on next check): {e}', exc_info=True)
@@ -38,6 +66,7 @@ def device_saved(sender, instance, created, **kwargs):
 @receiver(post_delete, sender=Device)
 def device_deleted(sender, instance, **kwargs):
     """Unsubscribe from MQTT when a device is deleted."""
+    _signal_resubscribe()
     if not instance.mqtt_broker_host or not instance.mqtt_topic_pattern:
         return
     
@@ -48,3 +77,24 @@ def device_deleted(sender, instance, **kwargs):
         logger.info(f'Unsubscribed device {instance.id} ({instance.name}) from MQTT after deletion')
     except Exception as e:
         logger.error(f'Failed to unsubscribe device {instance.id} from MQTT: {e}', exc_info=True)
+
+
+@receiver(m2m_changed, sender=Device.assigned_users.through)
+def device_assignment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop cached visible-device ids for every user whose assignments changed."""
+    if action in ('post_add', 'post_remove'):
+        # Forward (device.assigned_users): pk_set holds user ids; reverse (user.assigned_devices): the user is instance
+        user_ids = [instance.pk] if reverse else pk_set
+    elif action == 'pre_clear':
+        user_ids = [instance.pk] if reverse else list(instance.assigned_users.values_list('id', flat=True))
+    else:
+        return
+    cache.delete_many([visible_devices_cache_key(user_id) for user_id in user_ids or ()])
+
+
+@receiver(post_save, sender=ParameterMapping)
+@receiver(post_delete, sender=ParameterMapping)
+def parameter_mapping_changed(sender, **kwargs):
+    """Reload alarm parameter labels on the next threshold check."""
+    from .services import invalidate_parameter_labels
+    invalidate_parameter_labels()
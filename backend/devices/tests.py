@@ -1,3 +1,98 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from .models import Device
+from .routing import CHANGE_CHECK_SECONDS, MISS_CHECK_SECONDS, DeviceRouter, TopicTrie
+
+
+class TopicTrieTests(TestCase):
+    def test_exact_level_beats_plus_beats_hash(self):
+        trie = TopicTrie()
+        trie.insert('site/#', 'hash')
+        trie.insert('site/+/power', 'plus')
+        trie.insert('site/a/power', 'exact')
+        self.assertEqual(trie.match('site/a/power'), 'exact')
+        self.assertEqual(trie.match('site/b/power'), 'plus')
+        self.assertEqual(trie.match('site/b/energy'), 'hash')
+
+    def test_plus_matches_one_level_only(self):
+        trie = TopicTrie()
+        trie.insert('site/+', 'plus')
+        self.assertEqual(trie.match('site/a'), 'plus')
+        self.assertIsNone(trie.match('site/a/b'))
+        self.assertIsNone(trie.match('site'))
+
+    def test_hash_matches_parent_level(self):
+        trie = TopicTrie()
+        trie.insert('site/#', 'hash')
+        self.assertEqual(trie.match('site'), 'hash')
+        self.assertEqual(trie.match('site/a/b/c'), 'hash')
+        self.assertIsNone(trie.match('other/a'))
+
+    def test_first_insert_wins(self):
+        trie = TopicTrie()
+        trie.insert('site/+', 'first')
+        trie.insert('site/+', 'second')
+        self.assertEqual(trie.match('site/a'), 'first')
+
+
+class DeviceRouterTests(TestCase):
+    def setUp(self):
+        self.router = DeviceRouter()
+
+    def create_device(self, hardware_address, pattern, **kwargs):
+        return Device.objects.create(
+            name=f'Meter {hardware_address}', hardware_address=hardware_address,
+            mqtt_topic_pattern=pattern, **kwargs
+        )
+
+    def age_change_check(self, seconds):
+        # Pretend the last change check ran this many seconds ago
+        self.router._checked_at -= seconds
+
+    def test_exact_topic_beats_wildcards(self):
+        exact = self.create_device('10001', 'site/a/power')
+        plus = self.create_device('10002', 'site/+/power')
+        self.create_device('10003', 'site/#')
+        self.assertEqual(self.router.match_subscription('site/a/power'), (exact, 'topic'))
+        self.assertEqual(self.router.match_subscription('site/b/power'), (plus, 'wildcard'))
+        self.assertEqual(self.router.match_subscription('site/b/energy')[1], 'wildcard')
+
+    def test_only_active_fallback(self):
+        device = self.create_device('10001', 'site/a/power')
+        self.create_device('10002', 'site/b/power', is_active=False)
+        self.assertEqual(self.router.match_subscription('unknown/topic'), (device, 'only_active'))
+
+    def test_no_fallback_with_several_active_devices(self):
+        self.create_device('10001', 'site/a/power')
+        self.create_device('10002', 'site/b/power')
+        self.assertEqual(self.router.match_subscription('unknown/topic'), (None, None))
+
+    def test_fallback_rechecks_for_devices_added_elsewhere(self):
+        self.create_device('10001', 'site/a/power')
+        self.router.match_subscription('site/a/power')
+        # bulk_create sends no post_save, like a device saved by another process
+        added, = Device.objects.bulk_create([
+            Device(name='Meter 10002', hardware_address='10002', mqtt_topic_pattern='site/b/power')
+        ])
+        # Not due for the periodic check yet; only the fallback result triggers one
+        self.age_change_check((MISS_CHECK_SECONDS + CHANGE_CHECK_SECONDS) / 2)
+        self.assertEqual(self.router.match_subscription('site/b/power'), (added, 'topic'))
+
+    def test_change_check_drops_deactivated_devices(self):
+        self.create_device('10001', 'site/a/power')
+        self.create_device('10002', 'site/b/power')
+        self.assertEqual(self.router.match_subscription('site/b/power')[1], 'topic')
+        Device.objects.filter(hardware_address='10002').update(is_active=False)
+        self.age_change_check(CHANGE_CHECK_SECONDS)
+        device, how = self.router.match_subscription('site/b/power')
+        self.assertEqual((device.hardware_address, how), ('10001', 'only_active'))
+
+    @override_settings(MQTT_DEVICE_ROUTER_TTL=0)
+    def test_change_check_runs_without_ttl(self):
+        self.create_device('10001', 'site/a/power')
+        self.router.match_subscription('site/a/power')
+        added, = Device.objects.bulk_create([
+            Device(name='Meter 10002', hardware_address='10002', mqtt_topic_pattern='site/b/power')
+        ])
+        self.age_change_check(CHANGE_CHECK_SECONDS)
+        self.assertEqual(self.router.match_subscription('site/b/power'), (added, 'topic'))
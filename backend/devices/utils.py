@@ -1,9 +1,54 @@
 """Shared helpers for device visibility (used by device_data, alerts, grouping)."""
+from django.conf import settings
+from django.core.cache import cache
+
 from .models import Device
 
 
+def visible_devices_cache_key(user_id):
+    return f'visible_devices:{user_id}'
+
+
 def get_visible_devices_queryset(user):
-    """Same visibility as device list: super_admin/admin see all, user sees assigned only."""
+    """
+    Same visibility as device list: super_admin/admin see all, user sees assigned only.
+    No distinct() needed: filtering on one user matches each device once. Callers add their own
+    prefetches (they differ in which user columns they need).
+    """
     if user.has_role('super_admin', 'admin'):
         return Device.objects.all()
     return Device.objects.filter(assigned_users=user)
+
+
+def get_visible_device_ids(request):
+    """
+    Ids of the devices request.user can see, memoized on the request so get_queryset/get_object
+    share one lookup. Returns None for super_admin/admin, meaning no device filter is needed.
+    A regular user's id list is also kept in Django's cache for VISIBLE_DEVICES_CACHE_TIMEOUT
+    seconds; devices.signals drops it when the user's device assignments change. That setting is
+    0 (no caching) without a shared cache, since the drop would only reach the current process.
+    """
+    if not hasattr(request, '_visible_device_ids'):
+        user = request.user
+        if user.has_role('super_admin', 'admin'):
+            request._visible_device_ids = None
+        else:
+            timeout = settings.VISIBLE_DEVICES_CACHE_TIMEOUT
+            key = visible_devices_cache_key(user.pk)
+            device_ids = cache.get(key) if timeout > 0 else None
+            if device_ids is None:
+                device_ids = list(
+                    Device.objects.filter(assigned_users=user).values_list('id', flat=True)
+                )
+                if timeout > 0:
+                    cache.set(key, device_ids, timeout)
+            request._visible_device_ids = device_ids
+    return request._visible_device_ids
+
+
+def filter_visible_devices(queryset, request):
+    """Restrict a queryset of device-owned rows (device FK) to the devices request.user can see."""
+    device_ids = get_visible_device_ids(request)
+    if device_ids is None:
+        return queryset
+    return queryset.filter(device_id__in=device_ids)
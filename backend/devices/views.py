@@ -1,16 +1,42 @@
+import logging
+
 from rest_framework import generics, status, serializers
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.db import IntegrityError, connection, transaction
+from django.db.models import OuterRef, Prefetch, Subquery
 from django.shortcuts import get_object_or_404
 
+from accounts.models import User
 from .models import Device, ParameterMapping
 from .serializers import (
     DeviceSerializer, DeviceListSerializer, ParameterMappingSerializer,
     MQTTTestSerializer, MQTTDeviceRegistrationSerializer, MQTTConfigSerializer
 )
 from .services import test_mqtt_connection
-from core.pagination import DeviceListPagination
+from .utils import get_visible_device_ids, get_visible_devices_queryset
+from core.pagination import DeviceCursorPagination, DeviceListPagination
+
+logger = logging.getLogger(__name__)
+
+
+def _is_unique_violation(exc, column):
+    """True when an IntegrityError comes from the unique constraint on column (not e.g. a bad FK)."""
+    # psycopg2 exposes the constraint name (e.g. devices_hardware_address_key); SQLite only has the message
+    diag = getattr(exc.__cause__, 'diag', None)
+    target = getattr(diag, 'constraint_name', None) or str(exc)
+    return column in target
+
+
+def _device_exists_response(hardware_address):
+    return Response(
+        {
+            'error': 'Device already exists',
+            'message': f'Device with hardware address {hardware_address} is already registered'
+        },
+        status=status.HTTP_400_BAD_REQUEST
+    )
 
 
 class DeviceListView(generics.ListCreateAPIView):
@@ -21,17 +47,17 @@ class DeviceListView(generics.ListCreateAPIView):
     """
     serializer_class = DeviceSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = DeviceListPagination
+
+    @property
+    def pagination_class(self):
+        # Page numbers (with count) by default, which the frontend uses; keyset cursors on request
+        if self.request.query_params.get('paginate') == 'cursor':
+            return DeviceCursorPagination
+        return DeviceListPagination
 
     def get_queryset(self):
-        user = self.request.user
-        
-        # Super Admin and Admin see all devices
-        if user.has_role('super_admin', 'admin'):
-            queryset = Device.objects.all()
-        else:
-            # Regular users see only their assigned devices
-            queryset = Device.objects.filter(assigned_users=user)
+        # Super Admin and Admin see all devices, regular users only their assigned ones
+        queryset = get_visible_devices_queryset(self.request.user)
         
         # Filter by area, building, floor if provided
         area = self.request.query_params.get('area', None)
@@ -48,7 +74,19 @@ class DeviceListView(generics.ListCreateAPIView):
         if is_active is not None:
             queryset = queryset.filter(is_active=is_active.lower() == 'true')
         
-        return queryset.select_related().prefetch_related('assigned_users')
+        # DeviceListSerializer only renders assigned user ids and their count
+        if connection.vendor == 'postgresql':
+            # Aggregated by a correlated subquery on the through table, no second query for the M2M.
+            # Not ArrayAgg('assigned_users'): for regular users that would reuse the
+            # assigned_users=user join from the visibility filter and only see their own id.
+            from django.contrib.postgres.aggregates import ArrayAgg
+            user_ids = Device.assigned_users.through.objects.filter(
+                device_id=OuterRef('pk')
+            ).values('device_id').annotate(ids=ArrayAgg('user_id')).values('ids')
+            return queryset.annotate(assigned_user_id_list=Subquery(user_ids))
+        return queryset.prefetch_related(
+            Prefetch('assigned_users', queryset=User.objects.only('id'))
+        )
     
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -69,23 +107,19 @@ class DeviceListView(generics.ListCreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Check if hardware address already exists
-        hardware_address = serializer.validated_data['hardware_address']
-        if Device.objects.filter(hardware_address=hardware_address).exists():
-            return Response(
-                {
-                    'error': 'Device already exists',
-                    'message': f'Device with hardware address {hardware_address} is already registered'
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        device = serializer.save()
+        # Duplicate hardware addresses are rejected by the unique constraint on INSERT (no pre-check SELECT)
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError as e:
+            if not _is_unique_violation(e, 'hardware_address'):
+                raise
+            return _device_exists_response(serializer.validated_data['hardware_address'])
         
         return Response(
             {
                 'message': 'Device registered successfully',
-                'device': DeviceSerializer(device).data
+                'device': serializer.data
             },
             status=status.HTTP_201_CREATED
         )
@@ -115,8 +149,8 @@ class DeviceDetailView(generics.RetrieveUpdateDestroyAPIView):
         if user.has_role('admin'):
             return device
         
-        # Regular users can only access their assigned devices
-        if device.assigned_users.filter(id=user.id).exists():
+        # Regular users can only access their assigned devices (id list cached per user, see devices.utils)
+        if device.id in get_visible_device_ids(self.request):
             return device
         
         self.permission_denied(
@@ -141,20 +175,24 @@ class DeviceDetailView(generics.RetrieveUpdateDestroyAPIView):
         try:
             serializer = self.get_serializer(device, data=request.data, partial=True)
             serializer.is_valid(raise_exception=True)
-            updated_device = serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except IntegrityError as e:
+                if not _is_unique_violation(e, 'hardware_address'):
+                    raise
+                return _device_exists_response(serializer.validated_data['hardware_address'])
             
             # After successful update, trigger MQTT re-subscription via signal
             # The signal handler will automatically re-subscribe if MQTT config changed
             return Response(
                 {
                     'message': 'Device updated successfully',
-                    'device': DeviceSerializer(updated_device).data
+                    'device': serializer.data
                 },
                 status=status.HTTP_200_OK
             )
         except serializers.ValidationError as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f'Validation error updating device {device.id}: {e.detail if hasattr(e, "detail") else e}')
             return Response(
                 {
@@ -165,8 +203,6 @@ class DeviceDetailView(generics.RetrieveUpdateDestroyAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f'Error updating device {device.id}: {e}', exc_info=True)
             return Response(
                 {
@@ -193,6 +229,16 @@ class DeviceDetailView(generics.RetrieveUpdateDestroyAPIView):
         return super().destroy(request, *args, **kwargs)
 
 
+def _mapping_exists_response(hardware_key):
+    return Response(
+        {
+            'error': 'Mapping already exists',
+            'message': f'Parameter mapping for "{hardware_key}" already exists'
+        },
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
 class ParameterMappingListView(generics.ListCreateAPIView):
     """
     List all parameter mappings or create a new mapping
@@ -224,18 +270,14 @@ class ParameterMappingListView(generics.ListCreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Check if hardware_key already exists
-        hardware_key = serializer.validated_data['hardware_key']
-        if ParameterMapping.objects.filter(hardware_key=hardware_key).exists():
-            return Response(
-                {
-                    'error': 'Mapping already exists',
-                    'message': f'Parameter mapping for "{hardware_key}" already exists'
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        mapping = serializer.save()
+        # Duplicate keys are rejected by the unique constraint on INSERT (no pre-check SELECT)
+        try:
+            with transaction.atomic():
+                mapping = serializer.save()
+        except IntegrityError as e:
+            if not _is_unique_violation(e, 'hardware_key'):
+                raise
+            return _mapping_exists_response(serializer.validated_data['hardware_key'])
         
         return Response(
             {
@@ -272,7 +314,13 @@ class ParameterMappingDetailView(generics.RetrieveUpdateDestroyAPIView):
                 },
                 status=status.HTTP_403_FORBIDDEN
             )
-        return super().update(request, *args, **kwargs)
+        try:
+            with transaction.atomic():
+                return super().update(request, *args, **kwargs)
+        except IntegrityError as e:
+            if not _is_unique_violation(e, 'hardware_key'):
+                raise
+            return _mapping_exists_response(request.data.get('hardware_key'))
     
     def destroy(self, request, *args, **kwargs):
         if not request.user.has_role('super_admin'):
@@ -319,7 +367,8 @@ class MQTTTestView(APIView):
             password=validated_data.get('mqtt_password'),
             use_tls=validated_data.get('mqtt_use_tls', False),
             tls_ca_certs=validated_data.get('mqtt_tls_ca_certs'),
-            timeout_seconds=validated_data.get('timeout_seconds', 15)
+            timeout_seconds=validated_data.get('timeout_seconds', 15),
+            quiet_seconds=validated_data.get('quiet_seconds', 3)
         )
         
         if result['success']:
@@ -352,52 +401,36 @@ class MQTTDeviceRegistrationView(APIView):
         validated_data = serializer.validated_data
         hardware_address = validated_data['hardware_address']
         
-        # Check if device already exists
-        if Device.objects.filter(hardware_address=hardware_address).exists():
-            return Response(
-                {
-                    'error': 'Device already exists',
-                    'message': f'Device with hardware address {hardware_address} is already registered'
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         # Extract MQTT config
         mqtt_config = validated_data['mqtt_config']
         field_mappings = validated_data.get('field_mappings', {})
         
-        # Create device with MQTT configuration
-        device = Device.objects.create(
-            hardware_address=hardware_address,
-            name=validated_data['name'],
-            area=validated_data.get('area'),
-            building=validated_data.get('building'),
-            floor=validated_data.get('floor'),
-            mqtt_broker_host=mqtt_config['mqtt_broker_host'],
-            mqtt_broker_port=mqtt_config['mqtt_broker_port'],
-            mqtt_topic_prefix=mqtt_config['mqtt_topic_prefix'],
-            mqtt_topic_pattern=mqtt_config.get('mqtt_topic_pattern') or mqtt_config['mqtt_topic_prefix'],
-            mqtt_username=mqtt_config.get('mqtt_username'),
-            mqtt_password=mqtt_config.get('mqtt_password'),  # Store as plain text (can be encrypted later if needed)
-            mqtt_use_tls=mqtt_config.get('mqtt_use_tls', False),
-            mqtt_tls_ca_certs=mqtt_config.get('mqtt_tls_ca_certs'),
-            is_active=True
-        )
-        
-        # Immediately subscribe to MQTT for this device
-        # The signal handler will also try, but we do it here explicitly to ensure it happens
+        # Create device with MQTT configuration; a duplicate hardware address fails the unique constraint
         try:
-            from .mqtt_service import get_mqtt_connection_manager
-            import logging
-            logger = logging.getLogger(__name__)
-            manager = get_mqtt_connection_manager()
-            manager.subscribe_device(device)
-            logger.info(f'✓ Immediately subscribed device {device.id} ({device.name}) to MQTT during registration')
-        except Exception as e:
-            # Log but don't fail registration - signal handler will retry
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f'Failed to immediately subscribe device {device.id} to MQTT during registration: {e}', exc_info=True)
+            with transaction.atomic():
+                device = Device.objects.create(
+                    hardware_address=hardware_address,
+                    name=validated_data['name'],
+                    area=validated_data.get('area'),
+                    building=validated_data.get('building'),
+                    floor=validated_data.get('floor'),
+                    mqtt_broker_host=mqtt_config['mqtt_broker_host'],
+                    mqtt_broker_port=mqtt_config['mqtt_broker_port'],
+                    mqtt_topic_prefix=mqtt_config['mqtt_topic_prefix'],
+                    mqtt_topic_pattern=mqtt_config.get('mqtt_topic_pattern') or mqtt_config['mqtt_topic_prefix'],
+                    mqtt_username=mqtt_config.get('mqtt_username'),
+                    mqtt_password=mqtt_config.get('mqtt_password'),  # Store as plain text (can be encrypted later if needed)
+                    mqtt_use_tls=mqtt_config.get('mqtt_use_tls', False),
+                    mqtt_tls_ca_certs=mqtt_config.get('mqtt_tls_ca_certs'),
+                    is_active=True
+                )
+        except IntegrityError as e:
+            if not _is_unique_violation(e, 'hardware_address'):
+                raise
+            return _device_exists_response(hardware_address)
+        
+        # MQTT subscription is started by the post_save signal once the insert commits
+        # (devices.mqtt_service.subscribe_device_on_commit), so the response does not wait on the broker
         
         # Note: Field mappings are stored in ParameterMapping model separately
         # They are not directly linked to devices, but can be referenced by parameter_key
@@ -411,6 +444,13 @@ class MQTTDeviceRegistrationView(APIView):
         )
 
 
+# Columns returned by DeviceMQTTConfigView (never the password)
+MQTT_CONFIG_FIELDS = (
+    'mqtt_broker_host', 'mqtt_broker_port', 'mqtt_topic_prefix', 'mqtt_topic_pattern',
+    'mqtt_username', 'mqtt_use_tls', 'mqtt_tls_ca_certs',
+)
+
+
 class DeviceMQTTConfigView(generics.RetrieveAPIView):
     """
     Retrieve MQTT configuration for a device.
@@ -421,7 +461,7 @@ class DeviceMQTTConfigView(generics.RetrieveAPIView):
     lookup_field = 'id'
     
     def get_object(self):
-        device = get_object_or_404(Device, id=self.kwargs['id'])
+        device = get_object_or_404(Device.objects.only(*MQTT_CONFIG_FIELDS), id=self.kwargs['id'])
         user = self.request.user
         
         # Super Admin can access any device
@@ -432,8 +472,8 @@ class DeviceMQTTConfigView(generics.RetrieveAPIView):
         if user.has_role('admin'):
             return device
         
-        # Regular users can only access their assigned devices
-        if device.assigned_users.filter(id=user.id).exists():
+        # Regular users can only access their assigned devices (id list cached per user, see devices.utils)
+        if device.id in get_visible_device_ids(self.request):
             return device
         
         self.permission_denied(
@@ -444,16 +484,7 @@ class DeviceMQTTConfigView(generics.RetrieveAPIView):
     def retrieve(self, request, *args, **kwargs):
         device = self.get_object()
         
-        # Return only MQTT configuration
-        mqtt_config = {
-            'mqtt_broker_host': device.mqtt_broker_host,
-            'mqtt_broker_port': device.mqtt_broker_port,
-            'mqtt_topic_prefix': device.mqtt_topic_prefix,
-            'mqtt_topic_pattern': device.mqtt_topic_pattern,
-            'mqtt_username': device.mqtt_username,
-            'mqtt_use_tls': device.mqtt_use_tls,
-            'mqtt_tls_ca_certs': device.mqtt_tls_ca_certs,
-            # Don't return password for security
-        }
+        # Return only MQTT configuration (password is not in MQTT_CONFIG_FIELDS)
+        mqtt_config = {field: getattr(device, field) for field in MQTT_CONFIG_FIELDS}
         
         return Response(mqtt_config, status=status.HTTP_200_OK)
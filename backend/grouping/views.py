@@ -1,23 +1,35 @@
+import hashlib
 from collections import defaultdict
-from functools import reduce
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.db.models import Q, Max
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, OuterRef, Subquery
 
 from devices.models import Device, DeviceData
-from devices.utils import get_visible_devices_queryset
+from devices.services import get_device_data_version
+from devices.utils import filter_visible_devices, get_visible_device_ids
+from core.conditional import conditional_response, make_etag
+
+# Common Total kW key spellings, tried by dict lookup first
+TOTAL_KW_KEYS = ('tkW', 'tkw', 'total_kw')
+# Any other key matches when lowercased with underscores removed
+TOTAL_KW_NORMALIZED = frozenset({'tkw', 'totalkw'})
 
 
 def _get_total_kw_from_parameters(parameters):
     """Extract Total kW from device parameters (tkW, tkw, total_kw, case-insensitive)."""
     if not parameters or not isinstance(parameters, dict):
         return 0.0
+    # Direct lookups for the spellings devices actually send before scanning every key
+    for key in TOTAL_KW_KEYS:
+        value = parameters.get(key)
+        if isinstance(value, (int, float)):
+            return float(value)
     for key, value in parameters.items():
-        if key and isinstance(value, (int, float)):
-            k = key.lower().replace('_', '')
-            if k in ('tkw', 'totalkw', 'total_kw'):
-                return float(value)
+        if isinstance(value, (int, float)) and key and key.lower().replace('_', '') in TOTAL_KW_NORMALIZED:
+            return float(value)
     return 0.0
 
 
@@ -29,87 +41,97 @@ class GroupingView(generics.GenericAPIView):
     """
     permission_classes = [IsAuthenticated]
 
-    def get(self, request):
-        visible = get_visible_devices_queryset(request.user)
-        device_ids = list(visible.values_list('id', flat=True))
-        if not device_ids:
-            return Response({'areas': []})
-
-        devices = list(
-            Device.objects.filter(id__in=device_ids).exclude(
-                area__isnull=True
-            ).exclude(area='').exclude(
-                building__isnull=True
-            ).exclude(building='').exclude(
-                floor__isnull=True
-            ).exclude(floor='').values('id', 'area', 'building', 'floor')
+    def get_version(self, aggregation):
+        """
+        ETag for the grouping response (also the cache key): the newest visible reading, the visible
+        device set (ids for users, device count for admins) and the visible devices' last edit
+        (area/building/floor changes). The set changes on assignment edits, adds and deletes, which
+        leave updated_at alone. The DeviceData version counter covers readings that commit after a
+        newer one.
+        """
+        request = self.request
+        device_ids = get_visible_device_ids(request)
+        visible = Device.objects.count() if device_ids is None else hashlib.md5(
+            ','.join(map(str, sorted(device_ids))).encode()
+        ).hexdigest()
+        edited = self.visible_devices().aggregate(edited=Max('updated_at'))['edited']
+        last_modified = filter_visible_devices(DeviceData.objects.all(), request).aggregate(
+            last=Max('timestamp')
+        )['last']
+        etag = make_etag(
+            request.user.id,
+            aggregation,
+            visible,
+            edited.timestamp() if edited else 0,
+            last_modified.timestamp() if last_modified else 0,
+            get_device_data_version(),
         )
-        if not devices:
-            return Response({'areas': []})
-
-        latest_ts = DeviceData.objects.filter(
-            device_id__in=device_ids
-        ).values('device_id').annotate(latest_ts=Max('timestamp'))
-        pairs = [(row['device_id'], row['latest_ts']) for row in latest_ts]
-        params_by_device = {}
-        if pairs:
-            q = reduce(lambda a, b: a | b, [Q(device_id=d, timestamp=t) for d, t in pairs], Q())
-            for row in DeviceData.objects.filter(q).values('device_id', 'parameters'):
-                params_by_device[row['device_id']] = row.get('parameters') or {}
+        return etag, last_modified
 
+    def get(self, request):
         aggregation = (request.query_params.get('aggregation') or 'sum').lower()
         if aggregation not in ('sum', 'avg'):
             aggregation = 'sum'
 
-        groups = defaultdict(list)
+        etag, last_modified = self.get_version(aggregation)
+
+        def build_response():
+            # Same inputs give the same ETag, so the computed hierarchy is shared through the cache
+            areas = cache.get_or_set(
+                f'grouping:{etag}', lambda: self.build_areas(aggregation),
+                timeout=settings.GROUPING_CACHE_TIMEOUT,
+            )
+            return Response({'areas': areas})
+
+        return conditional_response(request, etag, build_response, last_modified=last_modified)
+
+    def visible_devices(self):
+        # Visible ids come memoized from the request / Django cache (no M2M join for regular users)
+        devices = Device.objects.all()
+        device_ids = get_visible_device_ids(self.request)
+        if device_ids is not None:
+            devices = devices.filter(id__in=device_ids)
+        return devices
+
+    def build_areas(self, aggregation):
+        # One query: visible, fully located devices with their newest reading's parameters alongside
+        # (a per-device index seek on (device, -timestamp))
+        latest_parameters = DeviceData.objects.filter(
+            device_id=OuterRef('pk')
+        ).order_by('-timestamp').values('parameters')[:1]
+        devices = list(
+            # "> ''" drops both NULL and empty strings: three plain comparisons, usable by the
+            # (area, building, floor) index
+            self.visible_devices().filter(area__gt='', building__gt='', floor__gt='').annotate(
+                latest_parameters=Subquery(latest_parameters)
+            ).values('id', 'area', 'building', 'floor', 'latest_parameters')
+        )
+        if not devices:
+            return []
+
+        # area -> building -> floor -> [(device_id, total_kw)]; dicts keep first-seen order at every level
+        tree = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
         for d in devices:
-            key = (d['area'], d['building'], d['floor'])
-            total_kw = _get_total_kw_from_parameters(params_by_device.get(d['id']))
-            groups[key].append((d['id'], total_kw))
-
-        area_order = {}
-        building_order = {}
-        floor_order = {}
-        for (area, building, floor) in groups:
-            if area not in area_order:
-                area_order[area] = len(area_order)
-            if (area, building) not in building_order:
-                building_order[(area, building)] = len(building_order)
-            if (area, building, floor) not in floor_order:
-                floor_order[(area, building, floor)] = len(floor_order)
+            total_kw = _get_total_kw_from_parameters(d['latest_parameters'])
+            tree[d['area']][d['building']][d['floor']].append((d['id'], total_kw))
 
         areas_list = []
-        seen_areas = set()
-        for (area, building, floor) in sorted(groups.keys(), key=lambda x: (area_order[x[0]], building_order[(x[0], x[1])], floor_order[x])):
-            if area not in seen_areas:
-                seen_areas.add(area)
-                areas_list.append({
-                    'name': area,
-                    'buildings': []
-                })
-            area_entry = next(a for a in areas_list if a['name'] == area)
-
-            building_entry = next((b for b in area_entry['buildings'] if b['name'] == building), None)
-            if not building_entry:
-                building_entry = {'name': building, 'floors': []}
-                area_entry['buildings'].append(building_entry)
-
-            device_ids_in_floor = []
-            total_kw_values = []
-            for dev_id, tw in groups[(area, building, floor)]:
-                device_ids_in_floor.append(dev_id)
-                total_kw_values.append(tw)
-
-            if aggregation == 'avg' and total_kw_values:
-                total_kw = sum(total_kw_values) / len(total_kw_values)
-            else:
-                total_kw = sum(total_kw_values)
-
-            building_entry['floors'].append({
-                'name': floor,
-                'device_ids': device_ids_in_floor,
-                'device_count': len(device_ids_in_floor),
-                'total_kw': round(total_kw, 2),
-            })
-
-        return Response({'areas': areas_list})
+        for area, buildings in tree.items():
+            buildings_list = []
+            for building, floors in buildings.items():
+                floors_list = []
+                for floor, members in floors.items():
+                    device_ids_in_floor = [dev_id for dev_id, _ in members]
+                    total_kw = sum(tw for _, tw in members)
+                    if aggregation == 'avg':
+                        total_kw /= len(members)
+                    floors_list.append({
+                        'name': floor,
+                        'device_ids': device_ids_in_floor,
+                        'device_count': len(device_ids_in_floor),
+                        'total_kw': round(total_kw, 2),
+                    })
+                buildings_list.append({'name': building, 'floors': floors_list})
+            areas_list.append({'name': area, 'buildings': buildings_list})
+
+        return areas_list
@@ -120,6 +120,15 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing - Argon2id first; existing PBKDF2 hashes are upgraded on next login
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
@@ -135,6 +144,33 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 
+# Cache - Redis (from .env) or in-process fallback
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds an authenticated user stays cached by CachedJWTAuthentication. Only used with Redis:
+# the in-process fallback is not shared, so other workers would miss the invalidation on
+# user save and keep authorizing stale data.
+USER_CACHE_TIMEOUT = config('USER_CACHE_TIMEOUT', default=60, cast=int) if REDIS_URL else 0
+
+# Seconds the public branding (title, logo path) stays cached. Saves drop the entry, but with the
+# in-process fallback only in the saving worker, so the others are stale until it expires.
+BRANDING_CACHE_TIMEOUT = config('BRANDING_CACHE_TIMEOUT', default=3600 if REDIS_URL else 30, cast=int)
+
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -149,7 +185,7 @@ AUTH_USER_MODEL = 'accounts.User'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
@@ -157,6 +193,11 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50,
+    # orjson encodes large list payloads (device data, alarms) several times faster than stdlib json
+    'DEFAULT_RENDERER_CLASSES': (
+        'drf_orjson_renderer.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 
@@ -201,9 +242,76 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 
+# Seconds a regular user's visible device ids stay cached (dropped on assignment changes).
+# Only used with Redis, for the same reason as USER_CACHE_TIMEOUT.
+VISIBLE_DEVICES_CACHE_TIMEOUT = config('VISIBLE_DEVICES_CACHE_TIMEOUT', default=30, cast=int) if REDIS_URL else 0
+
+# Seconds a computed /api/grouping/ response stays cached; the key changes with new readings and device edits
+GROUPING_CACHE_TIMEOUT = config('GROUPING_CACHE_TIMEOUT', default=60, cast=int)
+
+# Most rows one /api/device-data/list/?export=ndjson response streams; narrow from_date/to_date
+# or device_id for more. Bounds the export's DB time as well as its memory.
+DEVICE_DATA_EXPORT_MAX_ROWS = config('DEVICE_DATA_EXPORT_MAX_ROWS', default=100000, cast=int)
+
+# Minimum seconds between last_data_received writes per device (0 = write on every reading)
+LAST_DATA_RECEIVED_INTERVAL = config('LAST_DATA_RECEIVED_INTERVAL', default=5, cast=int)
+
+# Seconds the MQTT subscriber keeps its topic -> device table before a full reload. Device
+# saves/deletes in the same process drop it at once; other processes' edits are picked up by a
+# change check every few seconds, and the TTL covers queryset updates that check cannot see.
+# 0 = no forced reload; saves, deletes and the change check still reload it.
+MQTT_DEVICE_ROUTER_TTL = config('MQTT_DEVICE_ROUTER_TTL', default=60, cast=int)
+
+# MQTT 5 shared subscription group. When set, every MQTTConnectionManager subscribes as
+# "$share/<group>/<pattern>", so several processes (e.g. web workers with MQTT_AUTO_START) split the
+# messages instead of each storing every one. Needs a broker with MQTT 5 shared subscriptions.
+MQTT_SHARED_SUBSCRIPTION_GROUP = config('MQTT_SHARED_SUBSCRIPTION_GROUP', default='')
+
+# MQTT subscriber: readings are buffered and stored with one bulk_create per batch, flushed at
+# MQTT_PERSIST_BATCH_SIZE rows or MQTT_PERSIST_FLUSH_SECONDS after the first buffered reading.
+MQTT_PERSIST_BATCH_SIZE = config('MQTT_PERSIST_BATCH_SIZE', default=500, cast=int)
+MQTT_PERSIST_FLUSH_SECONDS = config('MQTT_PERSIST_FLUSH_SECONDS', default=1.0, cast=float)
+MQTT_PERSIST_QUEUE_SIZE = config('MQTT_PERSIST_QUEUE_SIZE', default=10000, cast=int)
+# PostgreSQL only: commit MQTT batches with synchronous_commit=off (no WAL flush wait). A crash can
+# lose the last fraction of a second of readings, never corrupt data; alarms stay fully durable.
+MQTT_PERSIST_ASYNC_COMMIT = config('MQTT_PERSIST_ASYNC_COMMIT', default=False, cast=bool)
+# Skip an MQTT reading identical to the device's last stored one, storing a repeat at most every
+# MQTT_SKIP_UNCHANGED_SECONDS as a heartbeat. 0 (default) stores every message.
+MQTT_SKIP_UNCHANGED_SECONDS = config('MQTT_SKIP_UNCHANGED_SECONDS', default=0, cast=int)
+
+# Module 5: Run the threshold/alarm check for POST /api/device-data/ and MQTT messages on a
+# background worker after the reading is stored, instead of inside the request / MQTT callback.
+# Set False to run it inline. At most THRESHOLD_CHECK_QUEUE_SIZE checks wait; extra ones are skipped.
+THRESHOLD_CHECK_ASYNC = config('THRESHOLD_CHECK_ASYNC', default=True, cast=bool)
+THRESHOLD_CHECK_QUEUE_SIZE = config('THRESHOLD_CHECK_QUEUE_SIZE', default=10000, cast=int)
+
+# Module 5: Seconds the hardware_key -> ui_label table used for alarm labels is reused before
+# reloading. ParameterMapping saves/deletes in the same process drop it at once.
+PARAMETER_LABEL_CACHE_TTL = config('PARAMETER_LABEL_CACHE_TTL', default=60, cast=int)
+
 # Module 5: Alarm email (optional). Comma-separated list or leave unset to skip.
 ALARM_EMAIL_TO = config('ALARM_EMAIL_TO', default='', cast=lambda v: [e.strip() for e in v.split(',') if e.strip()])
 
 # Email backend (for alarm notifications). Console backend logs to stdout when not configured.
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@localhost')
+
+# Logging: the devices app (MQTT subscriber, ingest) logs state changes at INFO; per-message
+# details are DEBUG. Set DEVICES_LOG_LEVEL=DEBUG to trace individual MQTT messages.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'devices': {
+            'handlers': ['console'],
+            'level': config('DEVICES_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
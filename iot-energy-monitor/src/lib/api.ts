@@ -723,7 +723,7 @@ export const historyService = {
       page_size: '5000'
     });
 
-    const response = await apiClient.get<{ count: number; next: string | null; results: { id: number; device: number; parameters: Record<string, number>; timestamp: string }[] }>(
+    const response = await apiClient.get<{ next: string | null; previous: string | null; results: { id: number; device: number; parameters: Record<string, number>; timestamp: string }[] }>(
       `/device-data/list/?${params.toString()}`
     );
     if (response.error || !response.data?.results) return [];